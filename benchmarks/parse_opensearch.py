@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Benchmark parsing of OpenSearch query results.
+
+Generates a synthetic feed of Sentinel-2 like entries and reports the throughput of
+sentinelsat.sentinel._parse_opensearch_response() in products per second, compared to the
+previous strptime-based implementation.
+
+Usage: python benchmarks/parse_opensearch.py [number of entries] [repeats]
+"""
+from __future__ import division, print_function
+
+import os
+import random
+import sys
+import timeit
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Run from a source checkout without installing sentinelsat
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sentinelsat.sentinel import _parse_opensearch_response  # noqa: E402
+
+
+def synthetic_entries(n, seed=0):
+    rnd = random.Random(seed)
+    start = datetime(2017, 1, 1)
+    entries = []
+    for i in range(n):
+        # Tiles of the same datatake share their sensing times
+        sensing = start + timedelta(minutes=10 * (i // 20))
+        ingestion = sensing + timedelta(hours=3, seconds=rnd.randint(0, 3600), milliseconds=rnd.randint(0, 999))
+        uuid = '%08x-%04x-%04x-%04x-%012x' % (rnd.getrandbits(32), rnd.getrandbits(16), rnd.getrandbits(16),
+                                              rnd.getrandbits(16), rnd.getrandbits(48))
+        title = 'S2A_MSIL1C_%s_N0204_R%03d_T%02dUUA_%s' % (
+            sensing.strftime('%Y%m%dT%H%M%S'), i % 143, i % 60, ingestion.strftime('%Y%m%dT%H%M%S'))
+        lon, lat = rnd.uniform(-180, 179), rnd.uniform(-80, 79)
+        footprint = 'POLYGON (({0} {1},{2} {1},{2} {3},{0} {3},{0} {1}))'.format(lon, lat, lon + 1, lat + 1)
+        product_url = "https://scihub.copernicus.eu/apihub/odata/v1/Products('%s')/" % uuid
+        entries.append({
+            'title': title,
+            'link': [{'href': product_url + '$value'},
+                     {'rel': 'alternative', 'href': product_url},
+                     {'rel': 'icon', 'href': product_url + "Products('Quicklook')/$value"}],
+            'id': uuid,
+            'summary': 'Date: %s, Instrument: MSI, Mode: , Satellite: Sentinel-2, Size: 750.31 MB' %
+                       sensing.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'date': [{'name': name,
+                      'content': value.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (value.microsecond // 1000)}
+                     for name, value in (('ingestiondate', ingestion), ('beginposition', sensing),
+                                         ('endposition', sensing))],
+            'int': [{'name': 'orbitnumber', 'content': str(8000 + i // 20)},
+                    {'name': 'relativeorbitnumber', 'content': str(i % 143)}],
+            'double': {'name': 'cloudcoverpercentage', 'content': '%.4f' % rnd.uniform(0, 100)},
+            'str': [{'name': name, 'content': value} for name, value in (
+                ('filename', title + '.SAFE'), ('gmlfootprint', footprint), ('format', 'SAFE'),
+                ('identifier', title), ('instrumentshortname', 'MSI'), ('instrumentname', 'Multi-Spectral Instrument'),
+                ('s2datatakeid', 'GS2A_%s_%06d_N02.04' % (sensing.strftime('%Y%m%dT%H%M%S'), i // 20)),
+                ('platformidentifier', '2015-028A'), ('orbitdirection', 'DESCENDING'),
+                ('platformserialidentifier', 'Sentinel-2A'), ('processinglevel', 'Level-1C'),
+                ('producttype', 'S2MSI1C'), ('platformname', 'Sentinel-2'), ('size', '750.31 MB'),
+                ('footprint', footprint), ('uuid', uuid))],
+        })
+    return entries
+
+
+def reference_parse(products):
+    """The strptime-based parser before the fast path, for comparison."""
+    def parse_iso_date(content):
+        if '.' in content:
+            return datetime.strptime(content, '%Y-%m-%dT%H:%M:%S.%fZ')
+        else:
+            return datetime.strptime(content, '%Y-%m-%dT%H:%M:%SZ')
+
+    output = OrderedDict()
+    for prod in products:
+        converters = {'date': parse_iso_date, 'int': int, 'long': int, 'float': float, 'double': float}
+
+        def default_converter(x):
+            return x
+
+        product_dict = {}
+        for key in prod:
+            if key == 'id':
+                continue
+            if isinstance(prod[key], str if sys.version_info >= (3,) else basestring):  # noqa: F821
+                product_dict[key] = prod[key]
+            else:
+                properties = prod[key]
+                if isinstance(properties, dict):
+                    properties = [properties]
+                if key == 'link':
+                    for p in properties:
+                        name = 'link'
+                        if 'rel' in p:
+                            name = 'link_' + p['rel']
+                        product_dict[name] = p['href']
+                else:
+                    f = converters.get(key, default_converter)
+                    for p in properties:
+                        try:
+                            product_dict[p['name']] = f(p['content'])
+                        except KeyError:
+                            product_dict[p['name']] = f(p['str'])
+        output[prod['id']] = product_dict
+    return output
+
+
+def main(n=100000, repeats=3):
+    entries = synthetic_entries(n)
+    assert reference_parse(entries) == _parse_opensearch_response(entries)
+    print('Parsing %d synthetic entries, best of %d runs' % (n, repeats))
+    results = {}
+    for name, parse in (('reference', reference_parse), ('_parse_opensearch_response', _parse_opensearch_response)):
+        seconds = min(timeit.repeat(lambda: parse(entries), number=1, repeat=repeats))
+        results[name] = seconds
+        print('{:<28} {:8.3f} s {:12,.0f} products/s'.format(name, seconds, n / seconds))
+    print('Speedup: %.2fx' % (results['reference'] / results['_parse_opensearch_response']))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -3,4 +3,9 @@ __version__ = '0.11'
 # Import for backwards-compatibility
 from . import sentinel
 
-from .sentinel import SentinelAPI, SentinelAPIError, InvalidChecksumError, read_geojson, geojson_to_wkt
+from .sentinel import SentinelAPI, SentinelAPIError, InvalidChecksumError, read_geojson, geojson_to_wkt, simplify_wkt, \
+    write_geojson
+from .cache import QueryCache
+from .products import LazyProduct, Product, ProductTable
+from .ratelimit import RateLimiter
+from .catalogue import ProductCatalogue
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""asyncio client for the Copernicus Open Access Hub. Requires Python 3.5+ and ``aiohttp``."""
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from os import remove
+from os.path import exists, getsize, join
+from urllib.parse import urljoin
+
+import aiohttp
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from . import __version__ as sentinelsat_version
+from .sentinel import (InvalidChecksumError, SentinelAPI, SentinelAPIError, _check_scihub_response,
+                       _md5_compare, _md5_update, _parse_odata_response, _parse_opensearch_entry)
+
+
+class AsyncSentinelAPI(object):
+    """asyncio version of SentinelAPI, based on ``aiohttp``.
+
+    All requests share a single connection pool, so that one event loop can drive many concurrent
+    page requests, metadata lookups and downloads. The methods correspond to the ones of
+    SentinelAPI, but are coroutines. Use it as an async context manager or call close() when done.
+
+    Parameters
+    ----------
+    user : string
+        username for DataHub
+    password : string
+        password for DataHub
+    api_url : string, optional
+        URL of the DataHub
+        defaults to 'https://scihub.copernicus.eu/apihub'
+    max_parallel_pages : int, optional
+        Maximum number of query result pages that are requested concurrently per query.
+        Defaults to 4.
+    connection_limit : int, optional
+        Maximum number of simultaneous connections in the pool. Defaults to 100.
+
+    Attributes
+    ----------
+    session : aiohttp.ClientSession
+        Session to connect to DataHub, created on first use
+    api_url : str
+        URL to the DataHub
+    page_size : int
+        number of results per query page
+    max_parallel_pages : int
+        maximum number of result pages of a query that are loaded concurrently
+    """
+
+    logger = logging.getLogger('sentinelsat.AsyncSentinelAPI')
+
+    format_query = staticmethod(SentinelAPI.format_query)
+    to_geojson = staticmethod(SentinelAPI.to_geojson)
+    to_dataframe = staticmethod(SentinelAPI.to_dataframe)
+    to_geodataframe = staticmethod(SentinelAPI.to_geodataframe)
+    get_products_size = staticmethod(SentinelAPI.get_products_size)
+
+    def __init__(self, user, password, api_url='https://scihub.copernicus.eu/apihub/',
+                 max_parallel_pages=4, connection_limit=100):
+        self.auth = aiohttp.BasicAuth(user, password) if user and password else None
+        self.api_url = api_url if api_url.endswith('/') else api_url + '/'
+        self.page_size = 100
+        self.max_parallel_pages = max_parallel_pages
+        self.connection_limit = connection_limit
+        self.user_agent = 'sentinelsat/' + sentinelsat_version
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connection_limit),
+                auth=self.auth,
+                headers={'User-Agent': self.user_agent})
+        return self._session
+
+    async def close(self):
+        """Close the session and its connection pool."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def query(self, area=None, initial_date='NOW-1DAY', end_date='NOW', **keywords):
+        """Query the OpenSearch API, see SentinelAPI.query()."""
+        query = self.format_query(area, initial_date, end_date, **keywords)
+        return await self.query_raw(query)
+
+    async def query_raw(self, query):
+        """Do a full-text query on the OpenSearch API, see SentinelAPI.query_raw()."""
+        entries = await self._load_query(query)
+        return OrderedDict(_parse_opensearch_entry(entry) for entry in entries)
+
+    async def _load_query(self, query, start_row=0):
+        entries, total_results = await self._load_query_page(query, start_row)
+
+        start_rows = range(start_row + self.page_size, total_results, self.page_size)
+        semaphore = asyncio.Semaphore(max(1, self.max_parallel_pages))
+
+        async def load_page(row):
+            async with semaphore:
+                page_entries, _ = await self._load_query_page(query, row)
+                return page_entries
+
+        # gather() returns the pages in server order
+        for page_entries in await asyncio.gather(*[load_page(row) for row in start_rows]):
+            entries += page_entries
+        return entries
+
+    async def _load_query_page(self, query, start_row, rows=None):
+        url = urljoin(self.api_url, 'search?format=json&rows={rows}&start={start}'.format(
+            rows=self.page_size if rows is None else rows, start=start_row))
+        async with self.session.post(url, data={'q': query}) as response:
+            json_response = await _check_response(response)
+
+        try:
+            json_feed = json_response['feed']
+            total_results = int(json_feed['opensearch:totalResults'])
+        except (ValueError, KeyError, TypeError):
+            # The aiohttp response cannot be attached to the error
+            raise SentinelAPIError('API response not valid. JSON decoding failed.')
+
+        entries = json_feed.get('entry', [])
+        if isinstance(entries, dict):
+            entries = [entries]
+        return entries, total_results
+
+    async def get_product_odata(self, id, full=False):
+        """Access OData API to get info about a product, see SentinelAPI.get_product_odata()."""
+        url = urljoin(self.api_url, "odata/v1/Products('{}')?$format=json".format(id))
+        if full:
+            url += '&$expand=Attributes'
+        async with self.session.get(url) as response:
+            json_response = await _check_response(response)
+        return _parse_odata_response(json_response['d'])
+
+    async def download(self, id, directory_path='.', checksum=False, check_existing=False):
+        """Download a product, see SentinelAPI.download()."""
+        loop = asyncio.get_event_loop()
+        product_info = await self.get_product_odata(id)
+        path = join(directory_path, product_info['title'] + '.zip')
+        product_info['path'] = path
+        product_info['downloaded_bytes'] = 0
+
+        self.logger.info('Downloading %s to %s' % (id, path))
+
+        if exists(path) and getsize(path) == product_info['size']:
+            if not check_existing or await loop.run_in_executor(
+                    None, _md5_compare, path, product_info['md5']):
+                self.logger.info('%s was already downloaded.' % path)
+                return product_info
+            else:
+                self.logger.info(
+                    '%s was already downloaded but is corrupt: checksums do not match. Re-downloading.' % path)
+                remove(path)
+
+        md5 = hashlib.md5() if checksum is True else None
+        product_info['downloaded_bytes'] = await self._download(product_info['url'], path, md5)
+
+        if checksum is True:
+            if md5.hexdigest().lower() != product_info['md5'].lower():
+                remove(path)
+                raise InvalidChecksumError('File corrupt: checksums do not match')
+        return product_info
+
+    async def _download(self, url, path, md5=None):
+        headers = {}
+        continuing = exists(path)
+        if continuing:
+            headers['Range'] = 'bytes={}-'.format(getsize(path))
+            if md5 is not None:
+                await asyncio.get_event_loop().run_in_executor(None, _md5_update, md5, path)
+        loop = asyncio.get_event_loop()
+        downloaded_bytes = 0
+        async with self.session.get(url, headers=headers) as response:
+            await _check_response(response, test_json=False)
+            with open(path, 'ab' if continuing else 'wb') as f:
+                async for chunk in response.content.iter_chunked(2 ** 20):
+                    # Writing and hashing are done in a thread to keep the event loop responsive
+                    await loop.run_in_executor(None, _write_chunk, f, chunk, md5)
+                    downloaded_bytes += len(chunk)
+        return downloaded_bytes
+
+    async def download_all(self, products, directory_path='.', max_attempts=10, checksum=False,
+                           check_existing=False, workers=4):
+        """Download a list of products concurrently, see SentinelAPI.download_all().
+
+        Parameters
+        ----------
+        workers : int, optional
+            Maximum number of products downloaded at the same time. Defaults to 4.
+
+        Other Parameters
+        ----------------
+        See SentinelAPI.download_all().
+        """
+        # Concurrent downloads of the same product would write to the same file
+        product_ids = list(OrderedDict.fromkeys(products))
+        self.logger.info("Will download %d products" % len(product_ids))
+        semaphore = asyncio.Semaphore(max(1, workers))
+        exceptions = []
+
+        async def download_product(product_id):
+            async with semaphore:
+                for attempt_num in range(max_attempts):
+                    try:
+                        return await self.download(product_id, directory_path, checksum, check_existing)
+                    except InvalidChecksumError as e:
+                        exceptions.append(e)
+                        self.logger.warning(
+                            "Invalid checksum. The downloaded file for '{}' is corrupted.".format(product_id))
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        exceptions.append(e)
+                        self.logger.exception("There was an error downloading %s" % product_id)
+
+        results = await asyncio.gather(*[download_product(product_id) for product_id in product_ids])
+        return_values = OrderedDict(
+            (product_id, product_info) for product_id, product_info in zip(product_ids, results)
+            if product_info is not None)
+        failed = set(product_ids) - set(return_values)
+
+        if len(failed) == len(product_ids) and exceptions:
+            raise exceptions[-1]
+        return return_values, failed
+
+
+def _write_chunk(f, chunk, md5=None):
+    f.write(chunk)
+    if md5 is not None:
+        md5.update(chunk)
+
+
+async def _check_response(response, test_json=True):
+    """Like sentinelsat.sentinel._check_scihub_response() for an aiohttp response.
+
+    Returns the decoded JSON content if test_json is True.
+    """
+    if response.status < 400 and not test_json:
+        return None
+    body = await response.read()
+    requests_response = requests.Response()
+    requests_response.status_code = response.status
+    requests_response.reason = response.reason
+    requests_response.url = str(response.url)
+    requests_response.headers = CaseInsensitiveDict(response.headers)
+    requests_response.encoding = response.charset or 'utf-8'
+    requests_response._content = body
+    return _check_scihub_response(requests_response, test_json)
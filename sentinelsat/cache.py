@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import calendar
+import hashlib
+import json
+import re
+import sqlite3
+import time
+import zlib
+from contextlib import closing
+
+from .sentinel import _parse_query_date
+
+
+class QueryCache(object):
+    """Persistent cache of raw OpenSearch query results, stored in an SQLite database.
+
+    Results are stored zlib-compressed and keyed by the API URL and the normalized query string.
+    Dates relative to NOW in a query (e.g. NOW-1DAY) are resolved and rounded down to multiples of
+    ``date_bucket`` seconds for the key, so that repeated runs of the same query within a bucket
+    share a cache entry, while runs in a later bucket do not.
+
+    Pass an instance to ``SentinelAPI(..., cache=QueryCache('queries.sqlite'))`` to enable caching
+    of ``query_raw()`` and ``query()`` results.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file. Created if it does not exist.
+    ttl : float, optional
+        Number of seconds a cached result stays valid. Defaults to 3600.
+    max_size : int, optional
+        Maximum total size of the compressed cached results in bytes. The least recently used
+        results are evicted once it is exceeded. Defaults to 100 MB.
+    date_bucket : int, optional
+        Resolution of dates relative to NOW in the cache keys in seconds. Defaults to ``ttl``.
+    """
+
+    def __init__(self, path, ttl=3600, max_size=100 * 2 ** 20, date_bucket=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.date_bucket = int(date_bucket or ttl)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS queries ('
+                'key TEXT PRIMARY KEY, created REAL, accessed REAL, size INTEGER, data BLOB)')
+
+    def get(self, api_url, query):
+        """Return the cached entries for a query or None if there is no valid cached result."""
+        key = self.key(api_url, query)
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute('SELECT created, data FROM queries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            created, data = row
+            if created + self.ttl < now:
+                conn.execute('DELETE FROM queries WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE queries SET accessed = ? WHERE key = ?', (now, key))
+        return json.loads(zlib.decompress(data).decode('utf-8'))
+
+    def set(self, api_url, query, entries):
+        """Store the entries of a query and evict old results if necessary."""
+        data = zlib.compress(json.dumps(entries).encode('utf-8'))
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO queries (key, created, accessed, size, data) VALUES (?, ?, ?, ?, ?)',
+                (self.key(api_url, query), now, now, len(data), sqlite3.Binary(data)))
+        self.evict()
+
+    def invalidate(self, api_url, query):
+        """Remove the cached result of a query."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM queries WHERE key = ?', (self.key(api_url, query),))
+
+    def clear(self):
+        """Remove all cached results."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM queries')
+
+    def evict(self):
+        """Remove expired results and the least recently used ones beyond max_size."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM queries WHERE created < ?', (time.time() - self.ttl,))
+            total_size = conn.execute('SELECT COALESCE(SUM(size), 0) FROM queries').fetchone()[0]
+            if total_size <= self.max_size:
+                return
+            rows = conn.execute('SELECT key, size FROM queries ORDER BY accessed').fetchall()
+            for key, size in rows:
+                if total_size <= self.max_size:
+                    break
+                conn.execute('DELETE FROM queries WHERE key = ?', (key,))
+                total_size -= size
+
+    def key(self, api_url, query):
+        """Return the cache key of a query."""
+        normalized = '\n'.join([api_url.rstrip('/'), self.normalize_query(query)])
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    def normalize_query(self, query):
+        """Collapse whitespace and replace dates relative to NOW with absolute dates rounded down
+        to date_bucket seconds.
+        """
+        def bucket(match):
+            seconds = calendar.timegm(_parse_query_date(match.group(0)).utctimetuple())
+            seconds -= seconds % self.date_bucket
+            return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds))
+
+        query = ' '.join(query.split())
+        return re.sub(r'\bNOW(?:-\d+(?:MONTH|DAY|HOUR|MINUTE)S?)?\b', bucket, query)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
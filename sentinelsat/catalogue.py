@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import fnmatch
+import json
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+
+from six import integer_types, string_types, text_type
+
+from .products import LazyProduct, Product
+from .sentinel import _parse_iso_date, _parse_query_date, _wkt_bounds
+
+
+class ProductCatalogue(object):
+    """Local catalogue of query results for offline searches, stored in an SQLite database.
+
+    Products are indexed by the bounding boxes of their footprints in an R-tree. Spatial queries
+    select candidates by bounding box and then compare the exact geometries, which requires
+    ``shapely`` to be installed.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path of the SQLite database file. Created if it does not exist.
+        Defaults to ':memory:', i.e. a catalogue that is not persisted.
+    """
+
+    columns = ('title', 'platformname', 'producttype', 'beginposition', 'endposition',
+               'ingestiondate', 'size', 'footprint')
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS products ('
+                'rowid INTEGER PRIMARY KEY, id TEXT UNIQUE, {}, properties TEXT)'.format(
+                    ', '.join(c + ' TEXT' for c in self.columns)))
+            for column in ('beginposition', 'platformname', 'producttype'):
+                self._conn.execute(
+                    'CREATE INDEX IF NOT EXISTS products_{0} ON products ({0} COLLATE NOCASE)'.format(column))
+            self._conn.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS footprints USING rtree(rowid, min_x, max_x, min_y, max_y)')
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+
+    def __contains__(self, product_id):
+        return self.get(product_id) is not None
+
+    def ingest(self, products):
+        """Add products to the catalogue or update them if they are already in it.
+
+        Parameters
+        ----------
+        products : dict[string, dict] or iterable of (string, dict) tuples
+            Products as returned by query() or yielded by iter_query()
+
+        Returns
+        -------
+        int
+            The number of ingested products
+        """
+        items = products.items() if isinstance(products, dict) else products
+        count = 0
+        with self._lock, self._conn:
+            for product_id, props in items:
+                values = [_sql_value(props.get(column)) for column in self.columns]
+                self._conn.execute(
+                    'DELETE FROM footprints WHERE rowid IN (SELECT rowid FROM products WHERE id = ?)',
+                    (product_id,))
+                cursor = self._conn.execute(
+                    'INSERT OR REPLACE INTO products (id, {}, properties) VALUES (?, {}, ?)'.format(
+                        ', '.join(self.columns), ', '.join('?' * len(self.columns))),
+                    [product_id] + values + [json.dumps(props, default=_encode_json)])
+                if props.get('footprint'):
+                    self._conn.execute(
+                        'INSERT INTO footprints (rowid, min_x, max_x, min_y, max_y) VALUES (?, ?, ?, ?, ?)',
+                        (cursor.lastrowid,) + _wkt_bounds(props['footprint']))
+                count += 1
+        return count
+
+    def get(self, product_id):
+        """Return the attributes of a product or None if it is not in the catalogue."""
+        with self._lock:
+            row = self._conn.execute('SELECT properties FROM products WHERE id = ?', (product_id,)).fetchone()
+        return None if row is None else json.loads(row[0], object_hook=_decode_json)
+
+    def query(self, area=None, initial_date='NOW-1DAY', end_date='NOW', **keywords):
+        """Search the catalogue with the same arguments as SentinelAPI.query().
+
+        Keyword values are matched case-insensitively. Ranges like '[0 TO 30]' and '*' wildcards
+        are supported.
+
+        Parameters
+        ----------
+        area : str
+            The area of interest formatted as a Well-Known Text string.
+        initial_date : str or datetime
+            Beginning of the time interval for sensing time. Defaults to 'NOW-1DAY'.
+            See SentinelAPI.query() for allowed formats.
+        end_date : str or datetime
+            End of the time interval for sensing time. Defaults to 'NOW'.
+
+        Other Parameters
+        ----------------
+        Additional keywords are matched against the product attributes, e.g. orbitnumber=70.
+
+        Returns
+        -------
+        dict[string, dict]
+            Matching products in the same format as returned by SentinelAPI.query().
+        """
+        conditions = []
+        params = []
+        if initial_date is not None and end_date is not None:
+            conditions.append('p.beginposition BETWEEN ? AND ?')
+            params += [_sql_value(_parse_query_date(initial_date)), _sql_value(_parse_query_date(end_date))]
+
+        area_geometry = None
+        sql = 'SELECT p.id, p.footprint, p.properties FROM products p'
+        if area is not None:
+            import shapely.prepared
+            import shapely.wkt
+
+            area_geometry = shapely.prepared.prep(shapely.wkt.loads(area))
+            min_x, max_x, min_y, max_y = _wkt_bounds(area)
+            sql += ' JOIN footprints f ON f.rowid = p.rowid'
+            conditions.append('f.min_x <= ? AND f.max_x >= ? AND f.min_y <= ? AND f.max_y >= ?')
+            params += [max_x, min_x, max_y, min_y]
+
+        # Exact matches on indexed columns are also filtered in SQL
+        for kw in ('platformname', 'producttype'):
+            value = keywords.get(kw)
+            if isinstance(value, string_types) and not _is_pattern(value):
+                conditions.append('p.{} = ? COLLATE NOCASE'.format(kw))
+                params.append(value)
+
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY p.rowid'
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        output = OrderedDict()
+        for product_id, footprint, properties in rows:
+            if area_geometry is not None:
+                if not footprint or not area_geometry.intersects(shapely.wkt.loads(footprint)):
+                    continue
+            props = json.loads(properties, object_hook=_decode_json)
+            if all(_match_keyword(props.get(kw), value) for kw, value in keywords.items()):
+                output[product_id] = props
+        return output
+
+
+def _is_pattern(value):
+    return '*' in value or re.match(r'^\s*[\[{].* TO .*[\]}]\s*$', value) is not None
+
+
+def _match_keyword(actual, expected):
+    """Match an attribute value with a full-text search keyword value."""
+    if actual is None:
+        return False
+    expected = text_type(expected).strip()
+    if len(expected) > 1 and expected[0] == expected[-1] == '"':
+        expected = expected[1:-1]
+
+    range_match = re.match(r'^([\[{])\s*(\S+)\s+TO\s+(\S+)\s*([\]}])$', expected)
+    if range_match:
+        lower_bracket, lower, upper, upper_bracket = range_match.groups()
+        convert = _keyword_converter(actual)
+        if lower != '*':
+            lower = convert(lower)
+            if actual < lower or (lower_bracket == '{' and actual == lower):
+                return False
+        if upper != '*':
+            upper = convert(upper)
+            if actual > upper or (upper_bracket == '}' and actual == upper):
+                return False
+        return True
+
+    if isinstance(actual, (datetime, float) + integer_types):
+        return actual == _keyword_converter(actual)(expected)
+    if '*' in expected:
+        return fnmatch.fnmatchcase(text_type(actual).lower(), expected.lower())
+    return text_type(actual).lower() == expected.lower()
+
+
+def _keyword_converter(actual):
+    if isinstance(actual, datetime):
+        return _parse_query_date
+    if isinstance(actual, (float,) + integer_types):
+        return float
+    return lambda x: x
+
+
+def _sql_value(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    return value
+
+
+def _encode_json(value):
+    if isinstance(value, (date, datetime)):
+        return {'$date': value.strftime('%Y-%m-%dT%H:%M:%S.%fZ')}
+    if isinstance(value, (LazyProduct, Product)):
+        return dict(value)
+    raise TypeError(repr(value) + ' is not JSON serializable')
+
+
+def _decode_json(obj):
+    if len(obj) == 1 and '$date' in obj:
+        return _parse_iso_date(obj['$date'])
+    return obj
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+from collections import OrderedDict
+
+from six import string_types
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # Python 2
+    from collections import MutableMapping
+
+
+class Product(MutableMapping):
+    """Memory-efficient record of the attributes of a product, which behaves like a dictionary.
+
+    The attributes that most OpenSearch results contain are stored in slots, so that their names
+    are not stored with every product. Any other attributes are kept in an overflow dictionary.
+    Values of attributes with few distinct values, like platformname and producttype, are shared
+    between all products.
+
+    Use ``SentinelAPI(..., compact=True)`` to get query results as Products.
+
+    Parameters
+    ----------
+    properties : dict, optional
+        Initial attributes of the product
+    """
+
+    fields = (
+        'title', 'link', 'link_alternative', 'link_icon', 'summary', 'uuid', 'identifier', 'filename',
+        'size', 'format', 'footprint', 'gmlfootprint', 'beginposition', 'endposition', 'ingestiondate',
+        'orbitnumber', 'relativeorbitnumber', 'lastorbitnumber', 'lastrelativeorbitnumber', 'orbitdirection',
+        'platformname', 'platformidentifier', 'platformserialidentifier', 'instrumentname',
+        'instrumentshortname', 'sensoroperationalmode', 'producttype', 'productclass', 'processinglevel',
+        'processingbaseline', 'productconsolidation', 'processed', 'status', 'acquisitiontype',
+        'polarisationmode', 'swathidentifier', 'missiondatatakeid', 'slicenumber', 's2datatakeid',
+        'cloudcoverpercentage',
+    )
+    enum_fields = frozenset([
+        'format', 'orbitdirection', 'platformname', 'platformidentifier', 'platformserialidentifier',
+        'instrumentname', 'instrumentshortname', 'sensoroperationalmode', 'producttype', 'productclass',
+        'processinglevel', 'processingbaseline', 'productconsolidation', 'status', 'acquisitiontype',
+        'polarisationmode', 'swathidentifier',
+    ])
+    __slots__ = fields + ('_extra',)
+
+    def __init__(self, properties=None):
+        self._extra = None
+        if properties:
+            self.update(properties)
+
+    def __getitem__(self, key):
+        if key in _field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in _field_set:
+            if key in Product.enum_fields:
+                value = _enum_values.setdefault(value, value)
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[_keys.setdefault(key, key)] = value
+
+    def __delitem__(self, key):
+        if key in _field_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        if key in _field_set:
+            return getattr(self, key, _missing) is not _missing
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for key in Product.fields:
+            if getattr(self, key, _missing) is not _missing:
+                yield key
+        if self._extra is not None:
+            for key in self._extra:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'Product(%r)' % dict(self)
+
+    def __reduce__(self):
+        return Product, (dict(self),)
+
+    def copy(self):
+        return Product(self)
+
+
+_field_set = frozenset(Product.fields)
+_missing = object()
+# Shared objects for overflow keys and values of enum_fields
+_keys = {}
+_enum_values = {}
+
+
+class LazyProduct(MutableMapping):
+    """Attributes of a product that are converted from the raw OpenSearch entry on first access.
+
+    Converted values are cached, so that every attribute is converted at most once and attributes
+    that are never read cost next to nothing. Behaves like the dictionaries returned by
+    SentinelAPI.query(). Use ``SentinelAPI(..., lazy=True)`` to get query results as LazyProducts.
+
+    Parameters
+    ----------
+    entry : dict
+        Raw OpenSearch entry of the product, as returned by the server
+    """
+
+    __slots__ = ('_entry', '_values', '_pending', '_geometry')
+
+    def __init__(self, entry):
+        self._entry = entry
+        # {<property>: <value>}, built on first access. The values of the properties in
+        # _pending are still raw strings that need to be converted to {<property>: <type>}.
+        self._values = None
+        self._pending = None
+        self._geometry = None
+
+    @property
+    def geometry(self):
+        """The footprint as a shapely geometry, decoded on first access. Requires ``shapely``."""
+        if self._geometry is None:
+            import shapely.wkt
+
+            self._geometry = shapely.wkt.loads(self['footprint'])
+        return self._geometry
+
+    def _index(self):
+        values = self._values
+        if values is None:
+            values = self._values = {}
+            pending = {}
+            for key, properties in self._entry.items():
+                if key == 'id':
+                    continue
+                if isinstance(properties, string_types):
+                    values[key] = properties
+                    continue
+                if isinstance(properties, dict):
+                    properties = [properties]
+                if key == 'link':
+                    for p in properties:
+                        values['link_' + p['rel'] if 'rel' in p else 'link'] = p['href']
+                    continue
+                for p in properties:
+                    content = p.get('content')
+                    if content is None:  # Sentinel-3 has one element 'arr' which violates the name:content convention
+                        content = p['str']
+                    values[p['name']] = content
+                if key != 'str':
+                    for p in properties:
+                        pending[p['name']] = key
+            self._pending = pending or None
+            # the raw entry is not needed anymore
+            self._entry = None
+        return values
+
+    def __getitem__(self, key):
+        values = self._values
+        if values is None:
+            # top-level strings like the title need no index
+            value = self._entry.get(key)
+            if key != 'id' and isinstance(value, string_types):
+                return value
+            values = self._index()
+        value = values[key]
+        pending = self._pending
+        if pending is not None and key in pending:
+            value = values[key] = _lazy_converter(pending.pop(key))(value)
+        return value
+
+    def __setitem__(self, key, value):
+        self._index()[key] = value
+        if self._pending is not None:
+            self._pending.pop(key, None)
+        if key == 'footprint':
+            self._geometry = None
+
+    def __delitem__(self, key):
+        del self._index()[key]
+        if self._pending is not None:
+            self._pending.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._index()
+
+    def __iter__(self):
+        return iter(self._index())
+
+    def __len__(self):
+        return len(self._index())
+
+    def __repr__(self):
+        return 'LazyProduct(%r)' % dict(self)
+
+    def __reduce__(self):
+        return _restore_lazy_product, (dict(self),)
+
+
+def _restore_lazy_product(values):
+    product = LazyProduct(None)
+    product._values = values
+    return product
+
+
+def _lazy_converter(kind):
+    if not _lazy_converters:
+        from .sentinel import _parse_iso_date
+
+        _lazy_converters.update({'date': _parse_iso_date, 'int': int, 'long': int, 'float': float, 'double': float})
+    return _lazy_converters.get(kind, _identity)
+
+
+def _identity(value):
+    return value
+
+
+_lazy_converters = {}
+
+
+class ProductTable(object):
+    """Columnar query results, with one typed numpy array per attribute.
+
+    Dates are stored as ``datetime64[ms]``, integers as ``int64`` and decimals as ``float64``.
+    The size is converted to an ``int64`` number of bytes. Integer columns with missing values are
+    stored as ``float64`` with NaN. Other attributes are stored in object arrays of strings, with
+    None for missing values.
+
+    Requires ``numpy``. Iterating over a ProductTable yields the product IDs, so it can be passed
+    to SentinelAPI.download_all() like the result of SentinelAPI.query().
+
+    Parameters
+    ----------
+    ids : numpy.ndarray
+        Product IDs
+    columns : OrderedDict[str, numpy.ndarray]
+        Attribute values, in the same order as ids
+    """
+
+    def __init__(self, ids, columns):
+        self.ids = ids
+        self.columns = columns
+
+    @classmethod
+    def from_entries(cls, entries):
+        """Convert raw OpenSearch entries, as returned by the server, to a ProductTable in a single pass."""
+        import numpy as np
+
+        ids = []
+        kinds = OrderedDict()
+        values = {}
+        for row, entry in enumerate(entries):
+            ids.append(entry['id'])
+            for key, properties in entry.items():
+                if key == 'id':
+                    continue
+                if isinstance(properties, string_types):
+                    items = ((key, properties),)
+                    kind = 'str'
+                else:
+                    if isinstance(properties, dict):
+                        properties = [properties]
+                    if key == 'link':
+                        items = (('link_' + p['rel'] if 'rel' in p else 'link', p['href']) for p in properties)
+                        kind = 'str'
+                    else:
+                        items = ((p['name'], p['content'] if 'content' in p else p['str']) for p in properties)
+                        kind = key
+                for name, value in items:
+                    column = values.get(name)
+                    if column is None:
+                        column = values[name] = []
+                        kinds[name] = kind
+                    if len(column) < row:
+                        column.extend([None] * (row - len(column)))
+                    column.append(value)
+
+        columns = OrderedDict()
+        for name, kind in kinds.items():
+            column = values.pop(name)
+            column.extend([None] * (len(ids) - len(column)))
+            columns[name] = _to_array(np, name, kind, column)
+        return cls(np.array(ids, dtype=object), columns)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __getitem__(self, name):
+        """Return the column of an attribute."""
+        return self.columns[name]
+
+    def to_dataframe(self):
+        """Return a Pandas DataFrame indexed by product ID, without converting the columns."""
+        import pandas as pd
+
+        return pd.DataFrame(self.columns, index=pd.Index(self.ids), columns=list(self.columns), copy=False)
+
+    def to_arrow(self):
+        """Return an Apache Arrow table with an 'id' column followed by the attribute columns.
+
+        Requires ``pyarrow``. Numeric and date columns are not copied.
+        """
+        import pyarrow as pa
+
+        names = ['id'] + list(self.columns)
+        arrays = [pa.array(self.ids, type=pa.string())]
+        arrays += [pa.array(column, from_pandas=True) for column in self.columns.values()]
+        return pa.Table.from_arrays(arrays, names=names)
+
+
+def _to_array(np, name, kind, values):
+    missing = None in values
+    if kind == 'date':
+        # numpy parses ISO 8601 dates, but without the time zone designator
+        return np.array([v[:-1] if v and v[-1] == 'Z' else (v or 'NaT') for v in values], dtype='datetime64[ms]')
+    if kind in ('int', 'long') and not missing:
+        return np.array(values).astype(np.int64)
+    if kind in ('int', 'long', 'float', 'double'):
+        return np.array(['nan' if v is None else v for v in values]).astype(np.float64)
+    if name == 'size':
+        sizes = [None if v is None else _size_to_bytes(v) for v in values]
+        return np.array(sizes, dtype=np.float64 if missing else np.int64)
+    if kind == 'str':
+        return np.array(values, dtype=object)
+    # Values may be lists, which must not become extra dimensions
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+_size_units = {'B': 1, 'KB': 2 ** 10, 'MB': 2 ** 20, 'GB': 2 ** 30, 'TB': 2 ** 40}
+
+
+def _size_to_bytes(size):
+    """Convert a size like '1.5 GB' to a number of bytes."""
+    value, unit = size.split(' ')
+    return int(round(float(value) * _size_units[unit]))
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+
+# time.monotonic() is not available on Python 2
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class RateLimiter(object):
+    """Token bucket that limits the throughput of downloads.
+
+    One limiter can be shared by any number of threads and downloads, which are then limited to
+    ``rate`` bytes per second in total. Bytes are taken from a bucket that is refilled at that
+    rate and holds at most ``burst`` bytes. A download that takes more bytes than are available
+    waits until the bucket has been refilled accordingly.
+
+    Pass an instance or a rate to ``SentinelAPI(..., max_download_rate=...)`` to limit all its
+    downloads. The rate can be changed at any time, also while downloads are running.
+
+    Parameters
+    ----------
+    rate : float or None
+        Maximum throughput in bytes per second. None or 0 for no limit.
+    burst : float, optional
+        Size of the bucket in bytes. Defaults to the number of bytes allowed per second.
+    """
+
+    def __init__(self, rate, burst=None):
+        self._lock = threading.Lock()
+        self._rate = rate or None
+        self._burst = burst
+        self._tokens = self.burst
+        self._updated = _clock()
+
+    @property
+    def rate(self):
+        """Maximum throughput in bytes per second or None if unlimited."""
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate):
+        with self._lock:
+            self._refill()
+            self._rate = rate or None
+            self._tokens = min(self._tokens, self.burst)
+
+    @property
+    def burst(self):
+        """Size of the bucket in bytes."""
+        if self._burst is not None:
+            return self._burst
+        return self._rate or 0
+
+    def consume(self, n):
+        """Take n bytes from the bucket, waiting until they are available."""
+        with self._lock:
+            if self._rate is None:
+                return
+            self._refill()
+            # Taking more bytes than available leaves a debt, which later calls also have to wait for
+            self._tokens -= n
+            wait = -self._tokens / self._rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def _refill(self):
+        now = _clock()
+        if self._rate is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
@@ -1,11 +1,11 @@
 import logging
 import os
+import sys
 
 import click
-import geojson as gj
 
 from sentinelsat import __version__ as sentinelsat_version
-from sentinelsat.sentinel import SentinelAPI, SentinelAPIError, geojson_to_wkt, read_geojson
+from sentinelsat.sentinel import SentinelAPI, SentinelAPIError, geojson_to_wkt, read_geojson, write_geojson
 
 logger = logging.getLogger('sentinelsat')
 
@@ -19,6 +19,19 @@ def _set_logger_handler(level='INFO'):
     logger.addHandler(h)
 
 
+def _parse_rate(ctx, param, value):
+    """Convert a rate like 500K, 10M or 1.5G (bytes per second) to a number of bytes."""
+    if value is None:
+        return None
+    units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
+    factor = units.get(value[-1:].upper(), 1)
+    number = value[:-1] if factor > 1 else value
+    try:
+        return float(number) * factor
+    except ValueError:
+        raise click.BadParameter('expected a number of bytes per second, optionally with K, M or G suffix')
+
+
 @click.group()
 def cli():
     _set_logger_handler()
@@ -80,10 +93,32 @@ def cli():
 @click.option(
     '-c', '--cloud', type=int,
     help='Maximum cloud cover in percent. (requires --sentinel to be 2 or 3)')
+@click.option(
+    '--dry-run', is_flag=True,
+    help='Only report the number of matching products and the estimated query effort.')
+@click.option(
+    '--all-features', is_flag=True,
+    help='Search the areas of all features in <geojson> instead of only the first one.')
+@click.option(
+    '--timeout', type=float, default=None,
+    help='Timeout for connecting to and reading from the server in seconds.')
+@click.option(
+    '--retries', type=int, default=3,
+    help='Number of retries after connection errors and temporary server errors.')
+@click.option(
+    '--connections', type=int, default=None,
+    help='Maximum number of connections kept open to the server.')
+@click.option(
+    '--workers', type=int, default=1,
+    help='Number of products downloaded at the same time.')
+@click.option(
+    '--limit-rate', type=str, default=None, callback=_parse_rate,
+    help='Maximum total download speed in bytes per second, e.g. 500K, 10M or 1G.')
 @click.version_option(version=sentinelsat_version, prog_name="sentinelsat")
 def search(
         user, password, geojson, start, end, download, md5, sentinel, producttype,
-        instrument, sentinel1, sentinel2, cloud, footprints, path, query, url):
+        instrument, sentinel1, sentinel2, cloud, footprints, path, query, url, dry_run,
+        all_features, timeout, retries, connections, workers, limit_rate):
     """Search for Sentinel products and, optionally, download all the results
     and/or create a geojson file with the search result footprints.
     Beyond your Copernicus Open Access Hub user and password, you must pass a geojson file
@@ -91,7 +126,11 @@ def search(
     don't specify the start and end dates, it will search in the last 24 hours.
     """
 
-    api = SentinelAPI(user, password, url)
+    if connections is None and workers > 10:
+        # keep one connection per download thread
+        connections = workers
+    api = SentinelAPI(user, password, url, timeout=timeout, max_retries=retries,
+                      pool_maxsize=connections, max_download_rate=limit_rate)
 
     search_kwargs = {}
     if sentinel and not (producttype or instrument):
@@ -122,16 +161,34 @@ def search(
     if query is not None:
         search_kwargs.update((x.split('=') for x in query.split(',')))
 
-    wkt = geojson_to_wkt(read_geojson(geojson))
-    products = api.query(wkt, start, end, **search_kwargs)
+    if all_features and dry_run:
+        raise click.UsageError('--dry-run cannot be combined with --all-features')
+
+    geojson_obj = read_geojson(geojson)
+    wkt = geojson_to_wkt(geojson_obj)
+
+    if dry_run is True:
+        plan = api.plan_query(wkt, start, end, **search_kwargs)
+        logger.info('%s scenes found in %s pages' % (plan['total_results'], plan['pages']))
+        logger.info('Estimated query time: %.1f s' % plan['estimated_seconds'])
+        if plan['suggested_shard_size'] is not None:
+            logger.info('Suggested sharding: %s shards of up to %s scenes' %
+                        (plan['suggested_shards'], plan['suggested_shard_size']))
+        return
+
+    if all_features is True and 'features' in geojson_obj:
+        areas = [geojson_to_wkt(geojson_obj, i) for i in range(len(geojson_obj['features']))]
+        products, _ = api.query_many(areas, start, end, **search_kwargs)
+    else:
+        products = api.query(wkt, start, end, **search_kwargs)
 
     if footprints is True:
-        footprints_geojson = api.to_geojson(products)
         with open(os.path.join(path, "search_footprints.geojson"), "w") as outfile:
-            outfile.write(gj.dumps(footprints_geojson))
+            write_geojson(products, outfile)
 
     if download is True:
-        product_infos, failed_downloads = api.download_all(products, path, checksum=md5)
+        product_infos, failed_downloads = api.download_all(products, path, checksum=md5,
+                                                           workers=workers)
         if md5 is True:
             if len(failed_downloads) > 0:
                 with open(os.path.join(path, "corrupt_scenes.txt"), "w") as outfile:
@@ -163,12 +220,25 @@ def search(
     help="""Verify the MD5 checksum and write corrupt product ids and filenames
     to corrupt_scenes.txt.')
     """)
+@click.option(
+    '--timeout', type=float, default=None,
+    help='Timeout for connecting to and reading from the server in seconds.')
+@click.option(
+    '--retries', type=int, default=3,
+    help='Number of retries after connection errors and temporary server errors.')
+@click.option(
+    '--connections', type=int, default=None,
+    help='Maximum number of connections kept open to the server.')
+@click.option(
+    '--limit-rate', type=str, default=None, callback=_parse_rate,
+    help='Maximum total download speed in bytes per second, e.g. 500K, 10M or 1G.')
 @click.version_option(version=sentinelsat_version, prog_name="sentinelsat")
-def download(user, password, productid, path, md5, url):
+def download(user, password, productid, path, md5, url, timeout, retries, connections, limit_rate):
     """Download a Sentinel Product with your Copernicus Open Access Hub user and password
     and the id of the product you want to download.
     """
-    api = SentinelAPI(user, password, url)
+    api = SentinelAPI(user, password, url, timeout=timeout, max_retries=retries,
+                      pool_maxsize=connections, max_download_rate=limit_rate)
     try:
         api.download(productid, path, md5)
     except SentinelAPIError as e:
@@ -176,3 +246,42 @@ def download(user, password, productid, path, md5, url):
             logger.error('No product with ID \'%s\' exists on server', productid)
         else:
             raise
+
+
+@cli.command()
+@click.argument('user', type=str, metavar='<user>')
+@click.argument('password', type=str, metavar='<password>')
+@click.argument('productids', type=str, nargs=-1, required=True, metavar='<productid>...')
+@click.option(
+    '--path', '-p', type=click.Path(exists=True), default='.',
+    help='Set the path where the files were saved.')
+@click.option(
+    '--url', '-u', type=str, default='https://scihub.copernicus.eu/apihub/',
+    help="""Define another API URL. Default URL is
+        'https://scihub.copernicus.eu/apihub/'.
+        """)
+@click.option(
+    '--workers', type=int, default=4,
+    help='Number of files verified at the same time.')
+@click.option(
+    '--timeout', type=float, default=None,
+    help='Timeout for connecting to and reading from the server in seconds.')
+@click.option(
+    '--retries', type=int, default=3,
+    help='Number of retries after connection errors and temporary server errors.')
+@click.version_option(version=sentinelsat_version, prog_name="sentinelsat")
+def verify(user, password, productids, path, url, workers, timeout, retries):
+    """Verify the MD5 checksums of downloaded Sentinel Products with your Copernicus Open Access
+    Hub user and password and the ids of the products. The ids and filenames of corrupt or missing
+    products are written to corrupt_scenes.txt and the exit status is 1 if there are any.
+    """
+    api = SentinelAPI(user, password, url, timeout=timeout, max_retries=retries)
+    results = api.verify_all(productids, path, workers=workers)
+    failed = [product_info for product_info in results.values() if not product_info['valid']]
+    if failed:
+        with open(os.path.join(path, "corrupt_scenes.txt"), "w") as outfile:
+            for product_info in failed:
+                # The title is unknown if the product could not be looked up
+                outfile.write("%s : %s\n" % (product_info['id'], product_info.get('title', '')))
+        logger.error('%s of %s products failed verification', len(failed), len(results))
+        sys.exit(1)
@@ -1,26 +1,37 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, division, print_function
 
+import calendar
 import hashlib
+import io
+import json
 import logging
+import os
 import re
+import threading
+import time
 import xml.etree.ElementTree as ET
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
 from datetime import date, datetime, timedelta
-from os import remove
-from os.path import exists, getsize, join
+from os import remove, rename
+from os.path import dirname, exists, getsize, join
 
 import geojson
 import geomet.wkt
 import html2text
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 from tqdm import tqdm
 
 from six import string_types
-from six.moves.urllib.parse import urljoin
+from six.moves.urllib.parse import quote, urljoin
 
 from . import __version__ as sentinelsat_version
+from .products import LazyProduct, Product, ProductTable
+from .ratelimit import RateLimiter
 
 
 class SentinelAPI(object):
@@ -35,6 +46,35 @@ class SentinelAPI(object):
     api_url : string, optional
         URL of the DataHub
         defaults to 'https://scihub.copernicus.eu/apihub'
+    max_parallel_pages : int, optional
+        Maximum number of query result pages that are requested concurrently.
+        Defaults to 4. Set to 1 to load the pages one after another.
+    cache : sentinelsat.QueryCache, optional
+        Cache for query results. Defaults to None (no caching).
+    timeout : float or tuple, optional
+        How long to wait for DataHub to respond in seconds, either for both connecting and
+        reading or as a (connect timeout, read timeout) tuple. Defaults to None (wait forever).
+    max_retries : int or urllib3.util.retry.Retry, optional
+        Number of times a request is retried after connection errors or 429, 502, 503 and 504
+        responses, with exponential backoff and honoring Retry-After headers. Defaults to 3.
+    pool_connections : int, optional
+        Number of hosts to keep connection pools for. Defaults to 10.
+    pool_maxsize : int, optional
+        Maximum number of connections kept open to a single host.
+        Defaults to max(10, max_parallel_pages).
+    json_decoder : callable, optional
+        Function that decodes the JSON responses of DataHub from bytes, e.g. ``orjson.loads``.
+        Defaults to ``orjson.loads`` or ``ujson.loads`` if either is installed, else the json module.
+    compact : bool, optional
+        Return the attributes of queried products as memory-efficient sentinelsat.Product records
+        instead of dictionaries. Defaults to False.
+    lazy : bool, optional
+        Return the attributes of queried products as sentinelsat.LazyProduct mappings, which
+        convert each value only when it is first accessed. Takes precedence over compact.
+        Defaults to False.
+    max_download_rate : float or sentinelsat.RateLimiter, optional
+        Maximum total throughput of all downloads in bytes per second, or a RateLimiter that
+        can be shared with other SentinelAPI instances. Defaults to None (no limit).
 
     Attributes
     ----------
@@ -45,23 +85,55 @@ class SentinelAPI(object):
     page_size : int
         number of results per query page
         current value: 100 (maximum allowed on ApiHub)
+    max_parallel_pages : int
+        maximum number of result pages of a query that are loaded concurrently
+    cache : sentinelsat.QueryCache or None
+        cache for query results
+    timeout : float, tuple or None
+        timeout passed to every request
+    compact : bool
+        whether queried products are returned as sentinelsat.Product records
+    lazy : bool
+        whether queried products are returned as sentinelsat.LazyProduct mappings
+    rate_limiter : sentinelsat.RateLimiter
+        limiter shared by all downloads, whose rate can be changed at any time
     """
 
     logger = logging.getLogger('sentinelsat.SentinelAPI')
 
-    def __init__(self, user, password, api_url='https://scihub.copernicus.eu/apihub/'):
+    def __init__(self, user, password, api_url='https://scihub.copernicus.eu/apihub/',
+                 max_parallel_pages=4, cache=None, timeout=None, max_retries=3,
+                 pool_connections=10, pool_maxsize=None, json_decoder=None, compact=False, lazy=False,
+                 max_download_rate=None):
         self.session = requests.Session()
         if user and password:
             self.session.auth = (user, password)
+        if not isinstance(max_retries, Retry):
+            max_retries = _retry_policy(max_retries)
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize or max(10, max_parallel_pages),
+                              max_retries=max_retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = timeout
+        self.json_decoder = json_decoder
+        self.compact = compact
+        self.lazy = lazy
+        if not isinstance(max_download_rate, RateLimiter):
+            max_download_rate = RateLimiter(max_download_rate)
+        self.rate_limiter = max_download_rate
         self.api_url = api_url if api_url.endswith('/') else api_url + '/'
         self.page_size = 100
+        self.max_parallel_pages = max_parallel_pages
+        self.cache = cache
         self.user_agent = 'sentinelsat/' + sentinelsat_version
         self.session.headers['User-Agent'] = self.user_agent
         # For unit tests
         self._last_query = None
         self._last_status_code = None
 
-    def query(self, area=None, initial_date='NOW-1DAY', end_date='NOW', **keywords):
+    def query(self, area=None, initial_date='NOW-1DAY', end_date='NOW', shard_size=None,
+              area_tolerance=None, area_max_vertices=None, **keywords):
         """Query the OpenSearch API with the coordinates of an area, a date interval
         and any other search keywords accepted by the API.
 
@@ -83,6 +155,18 @@ class SentinelAPI(object):
         end_date : str or datetime
             Beginning of the time interval for sensing time.  Defaults to 'NOW'.
             See initial_date for allowed format.
+        shard_size : int, optional
+            If set, the sensing time interval is split into sub-intervals matching at most
+            about shard_size products each. The sub-intervals are sized from their result counts,
+            queried concurrently and the results are merged. Useful for very large queries,
+            which would otherwise require deep paging. Defaults to None (no splitting).
+        area_tolerance : float, optional
+            If set, the area is simplified with this tolerance (in degrees) with simplify_wkt()
+            before it is sent to the server. The returned products are then filtered locally
+            by the exact area. Requires ``shapely``. Defaults to None (no simplification).
+        area_max_vertices : int, optional
+            If set, the area is simplified to at most this number of vertices with simplify_wkt()
+            before it is sent to the server, see area_tolerance. Defaults to None.
 
         Other Parameters
         ----------------
@@ -97,8 +181,348 @@ class SentinelAPI(object):
             Products returned by the query as a dictionary with the product ID as the key and
             the product's attributes (a dictionary) as the value.
         """
+        exact_area = area
+        if area is not None and (area_tolerance is not None or area_max_vertices is not None):
+            area = simplify_wkt(area, area_tolerance or 0, area_max_vertices)
+
+        if shard_size is not None:
+            products = self._query_sharded(area, initial_date, end_date, shard_size, **keywords)
+        else:
+            query = self.format_query(area, initial_date, end_date, **keywords)
+            products = self.query_raw(query)
+
+        if area != exact_area:
+            intersects = _intersection_test({0: exact_area}, {0: _wkt_bounds(exact_area)})
+            products = OrderedDict(
+                (product_id, props) for product_id, props in products.items()
+                if 'footprint' not in props or intersects(0, props['footprint']))
+        return products
+
+    def sync(self, area=None, state=None, initial_date='NOW-1DAY', **keywords):
+        """Query only the products ingested since the previous sync with the same state.
+
+        A high-water mark of the latest ingestion date seen so far, together with the IDs of the
+        products ingested at that instant, is kept in the state. Each call only queries products
+        with an ingestion date from the high-water mark until now and returns the ones that have
+        not been returned before.
+
+        Parameters
+        ----------
+        area : str
+            The area of interest formatted as a Well-Known Text string.
+        state : str or dict
+            Path of a JSON file or a dictionary holding the sync state. It is created by the first
+            sync and updated in place. Must only be used with a single query.
+        initial_date : str or datetime
+            Beginning of the time interval for the ingestion time in the first sync, when the state
+            is still empty. Defaults to 'NOW-1DAY'. See query() for allowed formats.
+
+        Other Parameters
+        ----------------
+        Additional keywords can be used to specify other query parameters, see query().
+
+        Returns
+        -------
+        dict[string, dict]
+            The newly ingested products in the same format as returned by query().
+        """
+        if state is None:
+            raise ValueError('A sync state (file path or dict) is required')
+        state_dict = state
+        if isinstance(state, string_types):
+            state_dict = {}
+            if exists(state):
+                with open(state) as f:
+                    state_dict = json.load(f)
+
+        base_query = self.format_query(area, None, None, **keywords)
+        if state_dict.get('query', base_query) != base_query:
+            raise ValueError('The sync state belongs to a different query: ' + state_dict['query'])
+
+        seen_ids = set(state_dict.get('ids', []))
+        watermark = state_dict.get('ingestiondate')
+        if watermark is None:
+            watermark = _format_query_date_ms(_parse_query_date(initial_date))
+        query = self.format_query(area, None, None, ingestiondate='[%s TO NOW]' % watermark, **keywords)
+        products = self.query_raw(query, refresh=True)
+
+        new_products = OrderedDict(
+            (product_id, props) for product_id, props in products.items() if product_id not in seen_ids)
+        self.logger.info('%d new products since %s' % (len(new_products), watermark))
+
+        if new_products:
+            latest = max(props['ingestiondate'] for props in new_products.values())
+            new_watermark = _format_query_date_ms(latest)
+            if new_watermark == watermark:
+                seen_ids.update(new_products)
+            else:
+                watermark = new_watermark
+                seen_ids = set(product_id for product_id, props in new_products.items()
+                               if props['ingestiondate'] == latest)
+
+        state_dict.update(query=base_query, ingestiondate=watermark, ids=sorted(seen_ids))
+        if isinstance(state, string_types):
+            with open(state, 'w') as f:
+                json.dump(state_dict, f, indent=2)
+        return new_products
+
+    def count(self, area=None, initial_date='NOW-1DAY', end_date='NOW', **keywords):
+        """Get the number of products matching a query without loading any of them.
+
+        Parameters
+        ----------
+        See query().
+
+        Returns
+        -------
+        int
+            The number of products matching the query
+        """
+        query = self.format_query(area, initial_date, end_date, **keywords)
+        return self._count_query(query)
+
+    def plan_query(self, area=None, initial_date='NOW-1DAY', end_date='NOW', max_pages_per_shard=5,
+                   **keywords):
+        """Estimate the amount of work required for a query by loading only its first result page.
+
+        The first page of results is loaded just as query() would and also provides the number of
+        matching products. The duration of that request is used to estimate how long loading all
+        result pages would take with the configured max_parallel_pages.
+
+        Parameters
+        ----------
+        max_pages_per_shard : int, optional
+            Sharding is suggested if the query requires more result pages than this.
+            Defaults to 5.
+
+        Other Parameters
+        ----------------
+        See query().
+
+        Returns
+        -------
+        dict[str, Any]
+            A dictionary with the following items:
+                - query: the query string
+                - total_results: the number of matching products
+                - pages: the number of result pages to be loaded
+                - estimated_seconds: the estimated time to load all pages in seconds
+                - suggested_shard_size: a shard_size value for query() or None if sharding is not needed
+                - suggested_shards: the approximate number of shards with the suggested shard size
+        """
+        query = self.format_query(area, initial_date, end_date, **keywords)
+        started = time.time()
+        _, total_results = self._load_query_page(query, 0)
+        request_seconds = time.time() - started
+
+        pages = -(-total_results // self.page_size)
+        # The first page is loaded on its own, the remaining ones max_parallel_pages at a time
+        rounds = 1 + -(-max(pages - 1, 0) // max(1, self.max_parallel_pages))
+        plan = {
+            'query': query,
+            'total_results': total_results,
+            'pages': pages,
+            'estimated_seconds': rounds * request_seconds,
+            'suggested_shard_size': None,
+            'suggested_shards': 0,
+        }
+        if pages > max_pages_per_shard and initial_date is not None and end_date is not None:
+            shard_size = max_pages_per_shard * self.page_size
+            plan['suggested_shard_size'] = shard_size
+            plan['suggested_shards'] = -(-total_results // shard_size)
+        return plan
+
+    def _query_sharded(self, area, initial_date, end_date, shard_size, **keywords):
+        """Split the sensing time interval of a query into shards, query them concurrently
+        and merge the results, dropping products returned by more than one shard.
+        """
+        if initial_date is None or end_date is None:
+            raise ValueError('Both initial_date and end_date are required to split a query into shards')
+
+        def shard_query(start, end):
+            return self.format_query(area, start, end, **keywords)
+
+        shards = self._plan_time_shards(shard_query, _parse_query_date(initial_date),
+                                        _parse_query_date(end_date), shard_size)
+        self.logger.info('Query split into %d shards' % len(shards))
+
+        output = OrderedDict()
+        if not shards:
+            return output
+        workers = max(1, min(self.max_parallel_pages, len(shards)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Shards are already loaded concurrently, so their pages are loaded one after another
+            results = executor.map(
+                lambda shard: self._load_query(shard_query(shard[0], shard[1]), max_parallel_pages=1),
+                shards)
+            for entries in results:
+                for entry in entries:
+                    product_id, properties = self._parse_entry(entry)
+                    if product_id not in output:
+                        output[product_id] = properties
+        return output
+
+    def _plan_time_shards(self, format_shard_query, start, end, shard_size):
+        """Split the time interval [start, end] into sub-intervals with at most shard_size results each.
+
+        Intervals with more results than that are split into proportionally many equal parts and
+        counted again, until every interval is small enough or shorter than two seconds.
+
+        Returns
+        -------
+        list[tuple[datetime, datetime, int]]
+            Start, end and result count of each non-empty shard in chronological order
+        """
+        if shard_size < 1:
+            raise ValueError('shard_size must be a positive integer')
+        shards = []
+        windows = [(start, end)]
+        workers = max(1, self.max_parallel_pages)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while windows:
+                counts = executor.map(
+                    lambda window: self._count_query(format_shard_query(*window)), windows)
+                next_windows = []
+                for (window_start, window_end), count in zip(windows, counts):
+                    parts = -(-count // shard_size)
+                    if parts > 1 and window_end - window_start >= timedelta(seconds=2):
+                        next_windows += _split_time_range(window_start, window_end, parts)
+                    elif count > 0:
+                        shards.append((window_start, window_end, count))
+                windows = next_windows
+        return sorted(shards)
+
+    def _count_query(self, query):
+        """Get the number of products matching the query without loading any of them."""
+        _, total_results = self._load_query_page(query, 0, rows=0)
+        return total_results
+
+    def iter_query(self, area=None, initial_date='NOW-1DAY', end_date='NOW', **keywords):
+        """Like query(), but lazily yield the products one at a time instead of returning them all at once.
+
+        Result pages are loaded and parsed as the generator is consumed, so that only a few pages
+        are held in memory at any time.
+
+        Parameters
+        ----------
+        See query().
+
+        Yields
+        ------
+        tuple[string, dict]
+            The product ID and the product's attributes (a dictionary), in the order returned by the server.
+        """
+        query = self.format_query(area, initial_date, end_date, **keywords)
+        return self.iter_query_raw(query)
+
+    def query_table(self, area=None, initial_date='NOW-1DAY', end_date='NOW', **keywords):
+        """Like query(), but return the products as a columnar sentinelsat.ProductTable.
+
+        The raw results are converted to one typed array per attribute directly, which can be
+        turned into a DataFrame or an Arrow table without converting them again. Requires numpy.
+
+        Parameters
+        ----------
+        See query().
+
+        Returns
+        -------
+        sentinelsat.ProductTable
+        """
         query = self.format_query(area, initial_date, end_date, **keywords)
-        return self.query_raw(query)
+        return ProductTable.from_entries(self._iter_query_entries(query))
+
+    def query_many(self, areas, initial_date='NOW-1DAY', end_date='NOW', max_query_length=4000,
+                   **keywords):
+        """Query the products intersecting any of several areas of interest.
+
+        Nearby areas are grouped into combined footprint clauses, as many as fit into a query of
+        max_query_length characters, to reduce the number of queries and the number of products
+        returned more than once. The groups are queried concurrently, the products are de-duplicated
+        and mapped back to the areas they intersect. Exact mapping requires ``shapely``, without it
+        the bounding boxes of the areas and footprints are compared.
+
+        Parameters
+        ----------
+        areas : list[str] or dict[Any, str]
+            The areas of interest formatted as Well-Known Text strings. If a list is given,
+            the areas are identified by their index in the list.
+        initial_date : str or datetime
+            See query().
+        end_date : str or datetime
+            See query().
+        max_query_length : int, optional
+            Maximum length of a single query string. Areas are never split, so a query with an area
+            that is larger than this on its own is still sent. Defaults to 4000.
+
+        Other Parameters
+        ----------------
+        Additional keywords can be used to specify other query parameters, see query().
+
+        Returns
+        -------
+        dict[string, dict]
+            The products intersecting any of the areas in the same format as returned by query().
+        dict[string, list]
+            The keys of the areas each product intersects.
+        """
+        if not isinstance(areas, dict):
+            areas = OrderedDict(enumerate(areas))
+        if not areas:
+            return OrderedDict(), {}
+
+        base_query = self.format_query(None, initial_date, end_date, **keywords)
+        bounds = dict((key, _wkt_bounds(wkt)) for key, wkt in areas.items())
+
+        # Order the areas along a Z-order curve so that consecutive areas are close to each other
+        def z_order(key):
+            min_x, max_x, min_y, max_y = bounds[key]
+            x = int(((min_x + max_x) / 2 + 180) / 360 * 0xffff)
+            y = int(((min_y + max_y) / 2 + 90) / 180 * 0xffff)
+            return sum(((x >> i & 1) << 2 * i) | ((y >> i & 1) << 2 * i + 1) for i in range(16))
+
+        # Start with one group per area and repeatedly merge the two neighboring groups
+        # with the smallest combined bounding box, as long as the query stays short enough
+        overhead = len(base_query) + len(' AND ()') - len(' OR ')
+        groups = [
+            ([key], bounds[key], len(' OR footprint:"Intersects()"') + len(areas[key]))
+            for key in sorted(areas, key=z_order)]
+        while len(groups) > 1:
+            candidates = []
+            for i, ((_, b1, l1), (_, b2, l2)) in enumerate(zip(groups[:-1], groups[1:])):
+                if overhead + l1 + l2 <= max_query_length:
+                    merged = (min(b1[0], b2[0]), max(b1[1], b2[1]), min(b1[2], b2[2]), max(b1[3], b2[3]))
+                    candidates.append((merged[1] - merged[0] + merged[3] - merged[2], i, merged))
+            if not candidates:
+                break
+            _, i, merged = min(candidates)
+            groups[i:i + 2] = [(groups[i][0] + groups[i + 1][0], merged, groups[i][2] + groups[i + 1][2])]
+        groups = [keys for keys, _, _ in groups]
+        self.logger.info('Querying %d areas in %d groups' % (len(areas), len(groups)))
+
+        def group_query(keys):
+            clause = ' OR '.join('footprint:"Intersects(%s)"' % areas[key] for key in keys)
+            return ' AND '.join(part for part in (base_query, '(%s)' % clause) if part)
+
+        products = OrderedDict()
+        product_areas = OrderedDict()
+        intersects = _intersection_test(areas, bounds)
+        workers = max(1, min(self.max_parallel_pages, len(groups)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                lambda keys: self._load_query(group_query(keys), max_parallel_pages=1), groups)
+            for keys, entries in zip(groups, results):
+                for entry in entries:
+                    product_id, properties = self._parse_entry(entry)
+                    if product_id not in products:
+                        products[product_id] = properties
+                        product_areas[product_id] = []
+                    footprint = properties.get('footprint')
+                    product_areas[product_id] += [
+                        key for key in keys
+                        if key not in product_areas[product_id] and
+                        (footprint is None or intersects(key, footprint))]
+        return products, product_areas
 
     @staticmethod
     def format_query(area=None, initial_date='NOW-1DAY', end_date='NOW', **keywords):
@@ -120,7 +544,7 @@ class SentinelAPI(object):
         query = ' AND '.join(query_parts)
         return query
 
-    def query_raw(self, query):
+    def query_raw(self, query, refresh=False):
         """Do a full-text query on the OpenSearch API using the format specified in
            https://scihub.copernicus.eu/twiki/do/view/SciHubUserGuide/3FullTextSearch
 
@@ -128,6 +552,9 @@ class SentinelAPI(object):
         ----------
         query : str
             The query string
+        refresh : bool, optional
+            If True and a cache is configured, ignore any cached result and query the server.
+            Defaults to False.
 
         Returns
         -------
@@ -135,26 +562,118 @@ class SentinelAPI(object):
             Products returned by the query as a dictionary with the product ID as the key and
             the product's attributes (a dictionary) as the value.
         """
-        response = self._load_query(query)
-        return _parse_opensearch_response(response)
+        return OrderedDict(self.iter_query_raw(query, refresh))
+
+    def iter_query_raw(self, query, refresh=False):
+        """Like query_raw(), but lazily yield the products one at a time instead of returning them all at once.
+
+        Parameters
+        ----------
+        query : str
+            The query string
+        refresh : bool, optional
+            See query_raw().
+
+        Yields
+        ------
+        tuple[string, dict]
+            The product ID and the product's attributes (a dictionary), in the order returned by the server.
+        """
+        for entry in self._iter_query_entries(query, refresh):
+            yield self._parse_entry(entry)
+
+    def _iter_query_entries(self, query, refresh=False):
+        """Yield the raw entries of a query, using the cache if one is configured."""
+        if self.cache is None:
+            pages = self._iter_query_pages(query)
+        else:
+            pages = self._iter_cached_query_pages(query, refresh)
+        for entries in pages:
+            for entry in entries:
+                yield entry
+
+    def _parse_entry(self, entry):
+        if self.lazy:
+            return entry['id'], LazyProduct(entry)
+        return _parse_opensearch_entry(entry, Product if self.compact else dict)
+
+    def _iter_cached_query_pages(self, query, refresh=False):
+        """Like _iter_query_pages(), but use and update the cache.
+
+        The result is only stored once all pages have been loaded.
+        """
+        if not refresh:
+            entries = self.cache.get(self.api_url, query)
+            if entries is not None:
+                self.logger.debug('Using cached result for query %s' % query)
+                yield entries
+                return
+        output = []
+        for entries in self._iter_query_pages(query):
+            output += entries
+            yield entries
+        self.cache.set(self.api_url, query, output)
+
+    def _load_query(self, query, start_row=0, max_parallel_pages=None):
+        """Load all entries matching the query, starting at start_row."""
+        output = []
+        for entries in self._iter_query_pages(query, start_row, max_parallel_pages):
+            output += entries
+        return output
+
+    def _iter_query_pages(self, query, start_row=0, max_parallel_pages=None):
+        """Yield the entries of each page of results matching the query, in server order.
 
-    def _load_query(self, query, start_row=0):
+        The first page is requested on its own to learn the total number of results.
+        The remaining pages are then requested concurrently, sharing the session. At most
+        max_parallel_pages pages (by default self.max_parallel_pages) are requested or
+        waiting to be consumed at any time.
+        """
+        if max_parallel_pages is None:
+            max_parallel_pages = self.max_parallel_pages
+        entries, total_results = self._load_query_page(query, start_row)
+        yield entries
+
+        start_rows = list(range(start_row + self.page_size, total_results, self.page_size))
+        if not start_rows:
+            return
+
+        workers = max(1, min(max_parallel_pages, len(start_rows)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for row in start_rows:
+                pending.append(executor.submit(self._load_query_page, query, row))
+                if len(pending) >= workers:
+                    yield pending.popleft().result()[0]
+            while pending:
+                yield pending.popleft().result()[0]
+
+    def _load_query_page(self, query, start_row, rows=None):
+        """Load a single page of query results. The page size defaults to self.page_size.
+
+        Returns
+        -------
+        list[dict]
+            The raw entries of the page
+        int
+            The total number of results reported by the server
+        """
         # store last query (for testing)
         self._last_query = query
 
         # load query results
-        url = self._format_url(start_row=start_row)
-        response = self.session.post(url, dict(q=query), auth=self.session.auth)
-        _check_scihub_response(response)
+        url = self._format_url(start_row=start_row, rows=rows)
+        response = self.session.post(url, dict(q=query), auth=self.session.auth, timeout=self.timeout)
+        json_response = _check_scihub_response(response, json_decoder=self.json_decoder)
 
         # store last status code (for testing)
         self._last_status_code = response.status_code
 
         # parse response content
         try:
-            json_feed = response.json()['feed']
+            json_feed = json_response['feed']
             total_results = int(json_feed['opensearch:totalResults'])
-        except (ValueError, KeyError):
+        except (ValueError, KeyError, TypeError):
             raise SentinelAPIError('API response not valid. JSON decoding failed.', response)
 
         entries = json_feed.get('entry', [])
@@ -162,16 +681,13 @@ class SentinelAPI(object):
         # one product, self.products will be a dict not a list
         if isinstance(entries, dict):
             entries = [entries]
+        return entries, total_results
 
-        output = entries
-        # repeat query until all results have been loaded
-        if total_results > start_row + self.page_size - 1:
-            output += self._load_query(query, start_row=(start_row + self.page_size))
-        return output
-
-    def _format_url(self, start_row=0):
+    def _format_url(self, start_row=0, rows=None):
+        if rows is None:
+            rows = self.page_size
         blank = 'search?format=json&rows={rows}&start={start}'.format(
-            rows=self.page_size, start=start_row
+            rows=rows, start=start_row
         )
         return urljoin(self.api_url, blank)
 
@@ -182,7 +698,7 @@ class SentinelAPI(object):
         """
         feature_list = []
         for i, (product_id, props) in enumerate(products.items()):
-            props = props.copy()
+            props = dict(props)
             props['id'] = product_id
             poly = geomet.wkt.loads(props['footprint'])
             del props['footprint']
@@ -203,6 +719,11 @@ class SentinelAPI(object):
         """
         import pandas as pd
 
+        if isinstance(products, ProductTable):
+            return products.to_dataframe()
+        if products and not isinstance(next(iter(products.values())), dict):
+            # e.g. Product records
+            products = OrderedDict((product_id, dict(props)) for product_id, props in products.items())
         return pd.DataFrame.from_dict(products, orient='index')
 
     @staticmethod
@@ -211,13 +732,14 @@ class SentinelAPI(object):
         with the values in their appropriate Python types.
         """
         import geopandas as gpd
-        import shapely.wkt
 
         df = SentinelAPI.to_dataframe(products)
         crs = {'init': 'epsg:4326'}  # WGS84
-        geometry = [shapely.wkt.loads(fp) for fp in df['footprint']]
-        # remove useless columns
-        df.drop(['footprint', 'gmlfootprint'], axis=1, inplace=True)
+        # remove useless columns in place instead of copying the frame
+        footprints = df.pop('footprint')
+        if 'gmlfootprint' in df:
+            del df['gmlfootprint']
+        geometry = _wkt_to_geometries(footprints.values)
         return gpd.GeoDataFrame(df, crs=crs, geometry=geometry)
 
     def get_product_odata(self, id, full=False):
@@ -248,18 +770,81 @@ class SentinelAPI(object):
         url = urljoin(self.api_url, "odata/v1/Products('{}')?$format=json".format(id))
         if full:
             url += '&$expand=Attributes'
-        response = self.session.get(url, auth=self.session.auth)
-        _check_scihub_response(response)
-        values = _parse_odata_response(response.json()['d'])
+        response = self.session.get(url, auth=self.session.auth, timeout=self.timeout)
+        json_response = _check_scihub_response(response, json_decoder=self.json_decoder)
+        values = _parse_odata_response(json_response['d'])
         return values
 
-    def download(self, id, directory_path='.', checksum=False, check_existing=False):
+    def get_products_odata(self, ids, full=False, batch_size=50):
+        """Access OData API to get info about many products in a few requests.
+
+        The products are looked up in batches with a ``$filter`` on their ids. Up to
+        ``max_parallel_pages`` batches are requested concurrently.
+
+        Parameters
+        ----------
+        ids : list
+            The IDs of the products to query, e.g. the return value of query()
+        full : bool
+            Whether to get the full metadata for the Products
+        batch_size : int, optional
+            Number of products looked up per request. Defaults to 50.
+
+        Returns
+        -------
+        dict[string, dict]
+            The metadata of every product that was found, see get_product_odata(), in the order
+            of ids
+        dict[string, Exception]
+            The error for every product that could not be looked up, either because it does not
+            exist or because the request of its batch failed
+        """
+        ids = list(OrderedDict.fromkeys(ids))
+        batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+        def load_batch(batch):
+            query = ' or '.join("Id eq '{}'".format(id) for id in batch)
+            url = urljoin(self.api_url, 'odata/v1/Products?$format=json&$top={}&$filter={}'.format(
+                len(batch), quote(query, safe="'")))
+            if full:
+                url += '&$expand=Attributes'
+            try:
+                response = self.session.get(url, auth=self.session.auth, timeout=self.timeout)
+                json_response = _check_scihub_response(response, json_decoder=self.json_decoder)
+                return [_parse_odata_response(product) for product in json_response['d']['results']], None
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception as e:
+                self.logger.warning("Could not look up the metadata of %d products: %s" % (len(batch), e))
+                return [], e
+
+        found = {}
+        failed = {}
+        workers = max(1, min(self.max_parallel_pages, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch, (results, error) in zip(batches, executor.map(load_batch, batches)):
+                for product_info in results:
+                    found[product_info['id']] = product_info
+                for id in batch:
+                    if id in found:
+                        continue
+                    failed[id] = error or SentinelAPIError(
+                        'Invalid key ({}) to access Products'.format(id))
+        output = OrderedDict((id, found[id]) for id in ids if id in found)
+        return output, failed
+
+    def download(self, id, directory_path='.', checksum=False, check_existing=False, segments=1,
+                 max_rate=None):
         """Download a product.
 
         Uses the filename on the server for the downloaded file, e.g.
         "S1A_EW_GRDH_1SDH_20141003T003840_20141003T003920_002658_002F54_4DD1.zip".
 
-        Incomplete downloads are continued and complete files are skipped.
+        The file is downloaded to "<title>.zip.part" first and renamed when it is complete.
+        The progress is recorded in a journal, "<directory_path>/.sentinelsat/<id>.json", which
+        holds the product's metadata, the size written so far and the server's validators.
+        Incomplete downloads are continued from it and complete files are skipped without looking
+        up the metadata on the server again.
 
         Parameters
         ----------
@@ -269,12 +854,21 @@ class SentinelAPI(object):
             Where the file will be downloaded
         checksum : bool, optional
             If True, verify the downloaded file's integrity by checking its MD5 checksum.
+            The checksum is computed while downloading, except for segmented downloads.
             Throws InvalidChecksumError if the checksum does not match.
             Defaults to False.
         check_existing : bool, optional
             If True and a fully downloaded file with the same name exists on the disk,
             verify its integrity using its MD5 checksum. Re-download in case of non-matching checksums.
             Defaults to False.
+        segments : int, optional
+            Number of byte ranges of the file that are downloaded in parallel over separate
+            connections. The file is preallocated and the progress of every range is stored in
+            the journal, so that an interrupted download only fetches the missing ranges.
+            Requires a server that supports range requests. Defaults to 1.
+        max_rate : float, optional
+            Maximum throughput of this download in bytes per second, in addition to the limit
+            of all downloads set with ``max_download_rate``. Defaults to None (no limit).
 
         Returns
         -------
@@ -286,41 +880,107 @@ class SentinelAPI(object):
         InvalidChecksumError
             If the MD5 checksum does not match the checksum on the server.
         """
-        product_info = self.get_product_odata(id)
+        # The journal of a complete download saves the metadata lookup
+        journal, product_info = _load_complete_download(directory_path, id)
+        if product_info is None:
+            product_info = self.get_product_odata(id)
+        return self._download_product(product_info, journal, directory_path, checksum, check_existing,
+                                      segments, max_rate)
+
+    def _download_product(self, product_info, journal, directory_path, checksum, check_existing,
+                          segments, max_rate, position=None):
+        """Download a product, given its metadata and download journal. See download().
+
+        position is the line of the progress bars, for downloads running in parallel.
+        """
+        id = product_info['id']
         path = join(directory_path, product_info['title'] + '.zip')
+        part_path = path + '.part'
         product_info['path'] = path
         product_info['downloaded_bytes'] = 0
 
         self.logger.info('Downloading %s to %s' % (id, path))
 
         # Check if the file exists and passes md5 test
-        # The download function will by default continue the download if the file exists but is incomplete
         if exists(path) and getsize(path) == product_info['size']:
-            if not check_existing or _md5_compare(path, product_info['md5']):
+            if not check_existing or _md5_compare(path, product_info['md5'], position=position):
                 self.logger.info('%s was already downloaded.' % path)
+                if journal is None or not journal.complete:
+                    _DownloadJournal(directory_path, product_info, complete=True).save()
                 return product_info
             else:
                 self.logger.info(
                     '%s was already downloaded but is corrupt: checksums do not match. Re-downloading.' % path)
                 remove(path)
 
+        # Continue an unfinished download only if the product is unchanged
+        if journal is None or not journal.matches(product_info) or not exists(part_path):
+            if exists(part_path):
+                remove(part_path)
+            journal = _DownloadJournal(directory_path, product_info)
+        journal.complete = False
+        # A partial file written by an earlier version of sentinelsat is continued as well
+        if exists(path):
+            if not exists(part_path):
+                rename(path, part_path)
+            else:
+                remove(path)
+        journal.save()
+
+        limiters = [self.rate_limiter]
+        if max_rate:
+            limiters.append(RateLimiter(max_rate))
+
         # Store the number of downloaded bytes for unit tests
-        product_info['downloaded_bytes'] = _download(product_info['url'], path, self.session, product_info['size'])
+        md5 = None
+        if segments > 1 or journal.ranges is not None:
+            try:
+                product_info['downloaded_bytes'] = _download_segmented(
+                    product_info['url'], part_path, self.session, product_info['size'], segments, journal,
+                    self.timeout, limiters, position)
+            except _FileChangedError:
+                # The partial file cannot be continued, start over without a validator
+                self.logger.info('%s has changed on the server. Restarting the download.' % id)
+                remove(part_path)
+                journal.remove()
+                journal = _DownloadJournal(directory_path, product_info)
+                journal.save()
+                product_info['downloaded_bytes'] = _download_segmented(
+                    product_info['url'], part_path, self.session, product_info['size'], segments, journal,
+                    self.timeout, limiters, position)
+        else:
+            # The ranges of a segmented download arrive out of order, a plain one is hashed on the fly
+            md5 = hashlib.md5() if checksum is True else None
+            product_info['downloaded_bytes'] = _download(
+                product_info['url'], part_path, self.session, product_info['size'], self.timeout, md5,
+                journal, limiters, position)
 
         # Check integrity with MD5 checksum
         if checksum is True:
-            if not _md5_compare(path, product_info['md5']):
-                remove(path)
+            if md5 is not None:
+                valid = md5.hexdigest().lower() == product_info['md5'].lower()
+            else:
+                valid = _md5_compare(part_path, product_info['md5'], position=position)
+            if not valid:
+                remove(part_path)
+                journal.remove()
                 raise InvalidChecksumError('File corrupt: checksums do not match')
+
+        _replace(part_path, path)
+        journal.complete = True
+        journal.save()
         return product_info
 
     def download_all(self, products, directory_path='.', max_attempts=10, checksum=False,
-                     check_existing=False):
+                     check_existing=False, workers=1, segments=1, max_rate=None):
         """Download a list of products.
 
         Takes a list of product IDs as input. This means that the return value of query() can be
         passed directly to this method.
 
+        The metadata of the products is looked up in batches with get_products_odata() beforehand,
+        except for products whose download journal shows that they are complete.
+
         File names on the server are used for the downloaded files, e.g.
         "S1A_EW_GRDH_1SDH_20141003T003840_20141003T003920_002658_002F54_4DD1.zip".
 
@@ -335,6 +995,11 @@ class SentinelAPI(object):
             Directory where the downloaded files will be downloaded
         max_attempts : int, optional
             Number of allowed retries before giving up downloading a product. Defaults to 10.
+        workers : int, optional
+            Number of products downloaded at the same time in separate threads. Each product is
+            retried independently and shows its progress on a line of its own. The connection pool
+            should hold at least this many connections, see the ``pool_maxsize`` argument of
+            SentinelAPI. Defaults to 1.
 
         Other Parameters
         ----------------
@@ -351,36 +1016,149 @@ class SentinelAPI(object):
         set[string]
             The list of products that failed to download.
         """
-        product_ids = list(products)
+        # Parallel downloads of the same product would write to the same files
+        product_ids = list(OrderedDict.fromkeys(products))
         self.logger.info("Will download %d products" % len(product_ids))
-        return_values = OrderedDict()
-        last_exception = None
-        for i, product_id in enumerate(products):
+        lock = threading.Lock()
+        state = {'finished': 0, 'last_exception': None}
+
+        # Look up the metadata of all products that are not complete yet in a few requests
+        journals = dict((product_id, _load_complete_download(directory_path, product_id))
+                        for product_id in product_ids)
+        pending = [product_id for product_id in product_ids if journals[product_id][1] is None]
+        prefetched = {}
+        if pending:
+            prefetched, not_prefetched = self.get_products_odata(pending)
+            if not_prefetched:
+                # They are looked up one by one again before downloading
+                self.logger.info("Could not prefetch the metadata of %d products" % len(not_prefetched))
+
+        # Every worker draws its progress bars on a line of its own
+        workers = max(1, min(workers, len(product_ids)))
+        free_positions = list(range(workers)) if workers > 1 else None
+
+        def download_product(product_id):
+            product_info = None
+            position = None
+            if free_positions is not None:
+                with lock:
+                    position = free_positions.pop(0)
             for attempt_num in range(max_attempts):
                 try:
-                    product_info = self.download(product_id, directory_path, checksum,
-                                                 check_existing)
-                    return_values[product_id] = product_info
+                    if attempt_num == 0:
+                        journal, known_info = journals[product_id]
+                        if known_info is None and product_id in prefetched:
+                            known_info = dict(prefetched[product_id])
+                    else:
+                        # Retries look up the journal and the metadata again, like download()
+                        journal, known_info = _load_complete_download(directory_path, product_id)
+                    if known_info is None:
+                        known_info = self.get_product_odata(product_id)
+                    product_info = self._download_product(
+                        known_info, journal, directory_path, checksum, check_existing, segments,
+                        max_rate, position)
                     break
                 except (KeyboardInterrupt, SystemExit):
                     raise
                 except InvalidChecksumError as e:
-                    last_exception = e
+                    with lock:
+                        state['last_exception'] = e
                     self.logger.warning(
                         "Invalid checksum. The downloaded file for '{}' is corrupted.".format(product_id))
                 except Exception as e:
-                    last_exception = e
+                    with lock:
+                        state['last_exception'] = e
                     self.logger.exception("There was an error downloading %s" % product_id)
-            self.logger.info("{}/{} products downloaded".format(i + 1, len(product_ids)))
-        failed = set(products) - set(return_values)
+            with lock:
+                state['finished'] += 1
+                self.logger.info("{}/{} products downloaded".format(state['finished'], len(product_ids)))
+                if position is not None:
+                    free_positions.append(position)
+            return product_info
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # map() returns the results in the order of product_ids
+                results = list(executor.map(download_product, product_ids))
+        else:
+            results = [download_product(product_id) for product_id in product_ids]
+
+        return_values = OrderedDict(
+            (product_id, product_info) for product_id, product_info in zip(product_ids, results)
+            if product_info is not None)
+        failed = set(product_ids) - set(return_values)
 
-        if len(failed) == len(product_ids) and last_exception is not None:
-            raise last_exception
+        if len(failed) == len(product_ids) and state['last_exception'] is not None:
+            raise state['last_exception']
         return return_values, failed
 
+    def verify_all(self, products, directory_path='.', workers=4):
+        """Verify the MD5 checksums of downloaded products.
+
+        The files are hashed in a pool of threads, which run in parallel because hashlib releases
+        the GIL while hashing large blocks. The checksums are taken from the download journals or
+        looked up on the server for products that are not given with their metadata.
+
+        Parameters
+        ----------
+        products : list or dict
+            List of product IDs, e.g. the return value of query(). If a dictionary of product info
+            dictionaries with 'title' and 'md5' values is given, such as the first return value of
+            download_all(), these are used instead of querying the server.
+        directory_path : string, optional
+            Directory where the products were downloaded
+        workers : int, optional
+            Number of files that are verified at the same time. Defaults to 4.
+
+        Returns
+        -------
+        dict[string, dict]
+            For each product, its info dictionary with the path of its file and a 'valid' value:
+            True if the checksum of the file matches, False if it does not or the file is
+            incomplete and None if there is no file. If the metadata of a product could not be
+            looked up, its dictionary only holds 'id', 'valid' (False) and the 'error'.
+        """
+        product_ids = list(products)
+        self.logger.info("Will verify %d products" % len(product_ids))
+        lock = threading.Lock()
+
+        def verify_product(product_id, progress):
+            product_info = products[product_id] if isinstance(products, dict) else None
+            if not product_info or 'md5' not in product_info or 'title' not in product_info:
+                journal = _DownloadJournal.load(directory_path, product_id)
+                if journal is not None:
+                    product_info = journal.product_info()
+                else:
+                    try:
+                        product_info = self.get_product_odata(product_id)
+                    except (KeyboardInterrupt, SystemExit):
+                        raise
+                    except Exception as e:
+                        self.logger.exception("Could not look up the metadata of %s" % product_id)
+                        return {'id': product_id, 'valid': False, 'error': e}
+            product_info = dict(product_info)
+            path = product_info['path'] = join(directory_path, product_info['title'] + '.zip')
+            product_info['valid'] = valid = _verify_file(path, product_info, progress, lock)
+            if valid is None:
+                self.logger.warning("No file for %s at %s" % (product_id, path))
+            elif not valid:
+                self.logger.warning("%s is incomplete or corrupt: checksums do not match" % path)
+            return product_info
+
+        with closing(tqdm(desc="MD5 checksumming", total=0, unit="B", unit_scale=True)) as progress:
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(product_ids)))) as executor:
+                results = list(executor.map(lambda product_id: verify_product(product_id, progress),
+                                            product_ids))
+        verified = OrderedDict(zip(product_ids, results))
+        self.logger.info("{}/{} products verified".format(
+            sum(1 for product_info in results if product_info['valid']), len(product_ids)))
+        return verified
+
     @staticmethod
     def get_products_size(products):
         """Return the total file size in GB of all products in the OpenSearch response"""
+        if isinstance(products, ProductTable):
+            return round(float(products['size'].sum()) / 2 ** 30, 2) if len(products) else 0
         size_total = 0
         for title, props in products.items():
             size_product = props["size"]
@@ -403,9 +1181,12 @@ class SentinelAPIError(Exception):
         self.response = response
 
     def __str__(self):
+        msg = self.msg or ''
+        if self.response is None:
+            return msg
         return 'HTTP status {0} {1}: {2}'.format(
             self.response.status_code, self.response.reason,
-            ('\n' if '\n' in self.msg else '') + self.msg)
+            ('\n' if '\n' in msg else '') + msg)
 
 
 class InvalidChecksumError(Exception):
@@ -414,11 +1195,58 @@ class InvalidChecksumError(Exception):
     pass
 
 
+class _FileChangedError(SentinelAPIError):
+    """The server ignored If-Range because its file has changed since the download started."""
+    pass
+
+
 def read_geojson(geojson_file):
     with open(geojson_file) as f:
         return geojson.load(f)
 
 
+def write_geojson(products, fileobj):
+    """Write products as a GeoJSON FeatureCollection, like the one returned by SentinelAPI.to_geojson().
+
+    The features are serialized and written one at a time, so that memory use does not grow
+    with the number of products.
+
+    Parameters
+    ----------
+    products : dict[string, dict] or iterable of (string, dict) tuples
+        Products as returned by query() or yielded by iter_query()
+    fileobj : file object
+        Text file to write to
+
+    Returns
+    -------
+    int
+        The number of written features
+    """
+    items = products.items() if hasattr(products, 'items') else products
+    fileobj.write('{"type": "FeatureCollection", "features": [')
+    count = 0
+    for product_id, props in items:
+        properties = dict((k, v) for k, v in props.items() if k not in ('footprint', 'gmlfootprint'))
+        properties['id'] = product_id
+        feature = {'type': 'Feature', 'id': count, 'geometry': geomet.wkt.loads(props['footprint']),
+                   'properties': properties}
+        fileobj.write((', ' if count else '') + json.dumps(feature, default=_json_date))
+        count += 1
+    fileobj.write(']}')
+    return count
+
+
+def _json_date(value):
+    """Serialize dates like SentinelAPI.to_geojson(), but faster than strftime()."""
+    if isinstance(value, datetime):
+        return '%04d-%02d-%02dT%02d:%02d:%02d.%06dZ' % (
+            value.year, value.month, value.day, value.hour, value.minute, value.second, value.microsecond)
+    if isinstance(value, date):
+        return '%04d-%02d-%02dT00:00:00.000000Z' % (value.year, value.month, value.day)
+    raise TypeError(repr(value) + ' is not JSON serializable')
+
+
 def geojson_to_wkt(geojson_obj, feature_number=0):
     """Convert a GeoJSON object to Well-Known Text. Intended for use with OpenSearch queries.
 
@@ -455,12 +1283,173 @@ def geojson_to_wkt(geojson_obj, feature_number=0):
     return geomet.wkt.dumps(geometry, decimals=7)
 
 
-def _check_scihub_response(response, test_json=True):
-    """Check that the response from server has status code 2xx and that the response is valid JSON."""
+def simplify_wkt(wkt, tolerance=0, max_vertices=None, decimals=7):
+    """Simplify a Well-Known Text area of interest to make queries with it smaller and faster.
+
+    The simplified geometry always contains the original one, so that a query with it returns
+    at least the products a query with the original geometry would. The results can then be
+    filtered locally by the exact geometry, as done by query() with area_tolerance or
+    area_max_vertices set. Requires ``shapely``.
+
+    If the simplified geometry has more than max_vertices vertices, the tolerance is doubled
+    until it does not. If that is not enough, the convex hull or finally the bounding box of
+    the geometry is used instead.
+
+    Parameters
+    ----------
+    wkt : str
+        The area of interest formatted as a Well-Known Text string
+    tolerance : float, optional
+        Maximum distance of the simplified geometry from the original one, in degrees.
+        Defaults to 0 (only as much as required for the coordinate precision).
+    max_vertices : int, optional
+        Maximum number of vertices of the simplified geometry. At least 5 vertices are always used
+        for polygons. Defaults to None (no limit).
+    decimals : int, optional
+        Number of decimals of the coordinates of the simplified geometry. Defaults to 7.
+
+    Returns
+    -------
+    str
+        The simplified geometry formatted as a Well-Known Text string
+    """
+    import shapely.geometry
+    import shapely.wkt
+
+    geometry = shapely.wkt.loads(wkt)
+    # The rounding of the coordinates must not move the boundary inside the original geometry
+    tolerance = max(tolerance, 10.0 ** -decimals)
+
+    simplified = None
+    for _ in range(10):
+        # Simplifying by half of the buffer distance keeps the original geometry inside
+        candidate = geometry.buffer(tolerance, join_style=2).simplify(tolerance / 2)
+        if max_vertices is None or _count_vertices(candidate) <= max_vertices:
+            simplified = candidate
+            break
+        tolerance *= 2
+    if simplified is None:
+        simplified = geometry.buffer(tolerance, join_style=2).convex_hull
+        if _count_vertices(simplified) > max_vertices:
+            min_x, min_y, max_x, max_y = simplified.bounds
+            simplified = shapely.geometry.box(min_x, min_y, max_x, max_y)
+
+    return geomet.wkt.dumps(shapely.geometry.mapping(simplified), decimals=decimals)
+
+
+def _count_vertices(geometry):
+    import shapely.geometry
+
+    def count(coords):
+        if coords and isinstance(coords[0], (list, tuple)):
+            return sum(count(c) for c in coords)
+        return 1
+
+    mapping = shapely.geometry.mapping(geometry)
+    return sum(count(g['coordinates']) for g in mapping.get('geometries', [mapping]))
+
+
+def _wkt_bounds(wkt):
+    """Return the (min_x, max_x, min_y, max_y) bounding box of a WKT geometry."""
+    xs = []
+    ys = []
+
+    def collect(coords):
+        if isinstance(coords[0], (list, tuple)):
+            for c in coords:
+                collect(c)
+        else:
+            xs.append(coords[0])
+            ys.append(coords[1])
+
+    geometry = geomet.wkt.loads(wkt)
+    for g in geometry.get('geometries', [geometry]):
+        collect(g['coordinates'])
+    return min(xs), max(xs), min(ys), max(ys)
+
+
+def _wkt_to_geometries(wkts):
+    """Convert an array of WKT strings to shapely geometries, in bulk if shapely 2 or geopandas
+    0.9+ is installed.
+    """
+    import shapely
+
+    if hasattr(shapely, 'from_wkt'):
+        return shapely.from_wkt(wkts)
+    import geopandas as gpd
+
+    if hasattr(gpd.GeoSeries, 'from_wkt'):
+        return gpd.GeoSeries.from_wkt(wkts).values
+    import shapely.wkt
+
+    return [shapely.wkt.loads(wkt) for wkt in wkts]
+
+
+def _intersection_test(areas, bounds):
+    """Return a function testing whether the area with the given key intersects a WKT footprint.
+
+    The exact geometries are compared if shapely is installed, otherwise their bounding boxes.
+    """
+    try:
+        import shapely.prepared
+        import shapely.wkt
+    except ImportError:
+        def intersects(key, footprint):
+            min_x, max_x, min_y, max_y = bounds[key]
+            fp_min_x, fp_max_x, fp_min_y, fp_max_y = _wkt_bounds(footprint)
+            return min_x <= fp_max_x and fp_min_x <= max_x and min_y <= fp_max_y and fp_min_y <= max_y
+        return intersects
+
+    geometries = dict((key, shapely.prepared.prep(shapely.wkt.loads(wkt))) for key, wkt in areas.items())
+
+    def intersects(key, footprint):
+        return geometries[key].intersects(shapely.wkt.loads(footprint))
+    return intersects
+
+
+def _select_json_decoder():
+    """Return a function that decodes a JSON document from bytes, using orjson or ujson if one of
+    them is installed and the json module otherwise.
+    """
+    for module_name in ('orjson', 'ujson'):
+        try:
+            return __import__(module_name).loads
+        except ImportError:
+            pass
+
+    def loads(content):
+        return json.loads(content.decode('utf-8'))
+
+    return loads
+
+
+_json_decoder = _select_json_decoder()
+
+
+def _retry_policy(total, backoff_factor=0.5):
+    """Retry policy for transient errors of DataHub, honoring Retry-After headers.
+
+    Searches are POST requests, but are safe to repeat.
+    """
+    kwargs = dict(total=total, backoff_factor=backoff_factor, status_forcelist=(429, 502, 503, 504),
+                  respect_retry_after_header=True, raise_on_status=False)
+    methods = frozenset(['HEAD', 'GET', 'POST'])
+    try:
+        return Retry(allowed_methods=methods, **kwargs)
+    except TypeError:  # urllib3 < 1.26
+        return Retry(method_whitelist=methods, **kwargs)
+
+
+def _check_scihub_response(response, test_json=True, json_decoder=None):
+    """Check that the response from server has status code 2xx and that the response is valid JSON.
+
+    Returns the decoded JSON content if test_json is True, so that it is only decoded once.
+    json_decoder defaults to the fastest available one, see _select_json_decoder().
+    """
     try:
         response.raise_for_status()
         if test_json:
-            response.json()
+            return (json_decoder or _json_decoder)(response.content)
     except (requests.HTTPError, ValueError):
         msg = "Invalid API response."
         try:
@@ -503,6 +1492,48 @@ def _format_query_date(in_date):
         raise ValueError('Unsupported date value {}'.format(in_date))
 
 
+def _format_query_date_ms(in_date):
+    """Format a datetime as YYYY-MM-DDThh:mm:ss.SSSZ, keeping the milliseconds."""
+    return in_date.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (in_date.microsecond // 1000)
+
+
+def _parse_query_date(in_date):
+    """Convert a date value accepted by query() to a datetime.
+
+    Dates relative to NOW are resolved against the current UTC time.
+    """
+    if isinstance(in_date, datetime):
+        return in_date
+    if isinstance(in_date, date):
+        return datetime(in_date.year, in_date.month, in_date.day)
+
+    in_date = _format_query_date(in_date)
+    match = re.match(r'^NOW(?:-(\d+)(MONTH|DAY|HOUR|MINUTE)S?)?$', in_date)
+    if not match:
+        return _parse_iso_date(in_date)
+
+    now = datetime.utcnow().replace(microsecond=0)
+    if match.group(1) is None:
+        return now
+    offset, unit = int(match.group(1)), match.group(2)
+    if unit != 'MONTH':
+        return now - timedelta(**{unit.lower() + 's': offset})
+    months = now.year * 12 + now.month - 1 - offset
+    year, month = months // 12, months % 12 + 1
+    day = min(now.day, calendar.monthrange(year, month)[1])
+    return now.replace(year=year, month=month, day=day)
+
+
+def _split_time_range(start, end, parts):
+    """Split the time interval [start, end] into (at most) the given number of equally long
+    sub-intervals with boundaries at whole seconds from start.
+    """
+    seconds = int((end - start).total_seconds())
+    parts = max(1, min(parts, seconds))
+    bounds = [start + timedelta(seconds=seconds * i // parts) for i in range(parts)] + [end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
 def _parse_gml_footprint(geometry_str):
     geometry_xml = ET.fromstring(geometry_str)
     poly_coords_str = geometry_xml \
@@ -515,6 +1546,20 @@ def _parse_gml_footprint(geometry_str):
 
 
 def _parse_iso_date(content):
+    """Parse a 'YYYY-MM-DDThh:mm:ss[.f]Z' date as returned by DataHub.
+
+    Slices the fixed-width fields directly, which is much faster than datetime.strptime().
+    Other formats are passed on to strptime().
+    """
+    length = len(content)
+    if (length == 20 or 22 <= length <= 27) and content[19] in ('.', 'Z') and content[-1] == 'Z' \
+            and content[4] == content[7] == '-' and content[10] == 'T' and content[13] == content[16] == ':':
+        try:
+            microsecond = int(content[20:-1].ljust(6, '0')) if length > 21 else 0
+            return datetime(int(content[:4]), int(content[5:7]), int(content[8:10]),
+                            int(content[11:13]), int(content[14:16]), int(content[17:19]), microsecond)
+        except ValueError:
+            pass
     if '.' in content:
         return datetime.strptime(content, '%Y-%m-%dT%H:%M:%S.%fZ')
     else:
@@ -534,41 +1579,90 @@ def _parse_opensearch_response(products):
     """Convert a query response to a dictionary.
 
     The resulting dictionary structure is {<product id>: {<property>: <value>}}.
-    The property values are converted to their respective Python types unless `parse_values` is set to `False`.
+    The property values are converted to their respective Python types.
     """
+    return OrderedDict(_parse_opensearch_entry(prod) for prod in products)
 
-    converters = {'date': _parse_iso_date, 'int': int, 'long': int, 'float': float, 'double': float}
-    # Keep the string type by default
-    default_converter = lambda x: x
-
-    output = OrderedDict()
-    for prod in products:
-        product_dict = {}
-        prod_id = prod['id']
-        output[prod_id] = product_dict
-        for key in prod:
-            if key == 'id':
-                continue
-            if isinstance(prod[key], string_types):
-                product_dict[key] = prod[key]
-            else:
-                properties = prod[key]
-                if isinstance(properties, dict):
-                    properties = [properties]
-                if key == 'link':
-                    for p in properties:
-                        name = 'link'
-                        if 'rel' in p:
-                            name = 'link_' + p['rel']
-                        product_dict[name] = p['href']
-                else:
-                    f = converters.get(key, default_converter)
-                    for p in properties:
-                        try:
-                            product_dict[p['name']] = f(p['content'])
-                        except KeyError:  # Sentinel-3 has one element 'arr' which violates the name:content convention
-                            product_dict[p['name']] = f(p['str'])
-    return output
+
+def _parse_opensearch_entry(prod, product_class=dict):
+    """Convert a single entry of a query response to a (<product id>, {<property>: <value>}) tuple.
+
+    The attributes are stored in a new instance of product_class, e.g. a sentinelsat.Product.
+    """
+    for cache in (_opensearch_string_cache, _opensearch_date_cache):
+        if len(cache) > _opensearch_cache_size:
+            cache.clear()
+    product_dict = product_class()
+    for key, properties in prod.items():
+        if key == 'id':
+            continue
+        if isinstance(properties, string_types):
+            product_dict[key] = properties
+            continue
+        if isinstance(properties, dict):
+            properties = [properties]
+        _opensearch_handlers.get(key, _parse_opensearch_other)(properties, product_dict)
+    return prod['id'], product_dict
+
+
+# Property names, dates and short strings (platform names, product types, ...) repeat across
+# products. They are converted once and the resulting objects are shared.
+_opensearch_names = {}
+_opensearch_string_cache = {}
+_opensearch_date_cache = {}
+_opensearch_cache_size = 2 ** 16
+
+
+def _parse_opensearch_links(properties, product_dict):
+    for p in properties:
+        product_dict['link_' + p['rel'] if 'rel' in p else 'link'] = p['href']
+
+
+def _parse_opensearch_strings(properties, product_dict, names=_opensearch_names, cache=_opensearch_string_cache):
+    for p in properties:
+        content = p.get('content')
+        if content is None:  # Sentinel-3 has one element 'arr' which violates the name:content convention
+            content = p['str']
+        if len(content) <= 32:
+            content = cache.setdefault(content, content)
+        name = p['name']
+        product_dict[names.setdefault(name, name)] = content
+
+
+def _parse_opensearch_dates(properties, product_dict, names=_opensearch_names, cache=_opensearch_date_cache):
+    for p in properties:
+        content = p.get('content')
+        if content is None:
+            content = p['str']
+        value = cache.get(content)
+        if value is None:
+            value = cache[content] = _parse_iso_date(content)
+        name = p['name']
+        product_dict[names.setdefault(name, name)] = value
+
+
+def _opensearch_value_parser(convert):
+    def parse(properties, product_dict, names=_opensearch_names):
+        for p in properties:
+            content = p.get('content')
+            if content is None:
+                content = p['str']
+            name = p['name']
+            product_dict[names.setdefault(name, name)] = convert(content)
+    return parse
+
+
+_opensearch_handlers = {
+    'link': _parse_opensearch_links,
+    'date': _parse_opensearch_dates,
+    'int': _opensearch_value_parser(int),
+    'long': _opensearch_value_parser(int),
+    'float': _opensearch_value_parser(float),
+    'double': _opensearch_value_parser(float),
+    'str': _parse_opensearch_strings,
+}
+# Keep the values of other types as they are
+_parse_opensearch_other = _opensearch_value_parser(lambda x: x)
 
 
 def _parse_odata_response(product):
@@ -595,36 +1689,330 @@ def _parse_odata_response(product):
     return output
 
 
-def _md5_compare(file_path, checksum, block_size=2 ** 13):
+def _progress_bar(desc, total, initial=0, position=None):
+    """Create a progress bar in bytes.
+
+    Bars with a position are drawn on that line below the cursor, so that the bars of parallel
+    downloads do not overwrite each other. They are removed when they are closed.
+    """
+    if position is None:
+        return tqdm(desc=desc, total=total, initial=initial, unit="B", unit_scale=True)
+    return tqdm(desc=desc, total=total, initial=initial, unit="B", unit_scale=True,
+                position=position, leave=False)
+
+
+def _md5_compare(file_path, checksum, block_size=2 ** 22, position=None):
     """Compare a given md5 checksum with one calculated from a file"""
-    with closing(tqdm(desc="MD5 checksumming", total=getsize(file_path), unit="B", unit_scale=True)) as progress:
-        md5 = hashlib.md5()
-        with open(file_path, "rb") as f:
-            while True:
-                block_data = f.read(block_size)
-                if not block_data:
-                    break
-                md5.update(block_data)
-                progress.update(len(block_data))
+    with closing(_progress_bar("MD5 checksumming", getsize(file_path), position=position)) as progress:
+        md5 = _md5_update(hashlib.md5(), file_path, block_size, progress.update)
         return md5.hexdigest().lower() == checksum.lower()
 
 
-def _download(url, path, session, file_size):
+def _verify_file(path, product_info, progress, lock):
+    """Check the size and MD5 checksum of a downloaded file, None if it does not exist"""
+    if not exists(path):
+        return None
+    size = getsize(path)
+    if 'size' in product_info and size != product_info['size']:
+        return False
+    with lock:
+        progress.total += size
+        progress.refresh()
+
+    def update(n):
+        with lock:
+            progress.update(n)
+
+    md5 = _md5_update(hashlib.md5(), path, callback=update)
+    return md5.hexdigest().lower() == product_info['md5'].lower()
+
+
+def _md5_update(md5, file_path, block_size=2 ** 22, callback=None):
+    """Update a hash object with the content of a file.
+
+    The file is read in large blocks into a reused buffer. hashlib releases the GIL while hashing
+    them, so that several files can be hashed in parallel threads. callback is called with the
+    size of every block.
+    """
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with io.open(file_path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            md5.update(view[:n])
+            if callback is not None:
+                callback(n)
+    return md5
+
+
+def _download(url, path, session, file_size, timeout=None, md5=None, journal=None, limiters=(),
+              position=None):
+    """Download a file, continuing a partial one.
+
+    If a hash object is given as md5, it is updated with the content of the file while it is
+    downloaded, starting with the partial file on disk. The number of bytes written and the
+    validators of the server are recorded in the journal, if given. The throughput is limited
+    by all of the given RateLimiters. position is the line of the progress bar.
+    """
     headers = {}
-    continuing = exists(path)
+    continuing = exists(path) and getsize(path) > 0
     if continuing:
-        headers = {'Range': 'bytes={}-'.format(getsize(path))}
+        headers['Range'] = 'bytes={}-'.format(getsize(path))
+        if journal is not None and journal.validator:
+            # The server sends the whole file if it has changed since
+            headers['If-Range'] = journal.validator
     downloaded_bytes = 0
-    with closing(session.get(url, stream=True, auth=session.auth, headers=headers)) as r, \
-            closing(tqdm(desc="Downloading", total=file_size, unit="B", unit_scale=True)) as progress:
+    with closing(session.get(url, stream=True, auth=session.auth, headers=headers, timeout=timeout)) as r, \
+            closing(_progress_bar("Downloading", file_size, position=position)) as progress:
         _check_scihub_response(r, test_json=False)
-        chunk_size = 2 ** 20  # download in 1 MB chunks
+        if continuing and r.status_code == 200 and 'If-Range' in headers:
+            continuing = False
+        if continuing and md5 is not None:
+            _md5_update(md5, path)
+        if journal is not None:
+            journal.set_validators(r)
+        chunk_size = _chunk_size(limiters)
         mode = 'ab' if continuing else 'wb'
         with open(path, mode) as f:
-            for chunk in r.iter_content(chunk_size=chunk_size):
-                if chunk:  # filter out keep-alive new chunks
-                    f.write(chunk)
-                    progress.update(len(chunk))
-                    downloaded_bytes += len(chunk)
+            committed = f.tell()
+            try:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    if chunk:  # filter out keep-alive new chunks
+                        for limiter in limiters:
+                            limiter.consume(len(chunk))
+                        f.write(chunk)
+                        if md5 is not None:
+                            md5.update(chunk)
+                        progress.update(len(chunk))
+                        downloaded_bytes += len(chunk)
+                        if journal is not None:
+                            f.flush()
+                            journal.committed = committed + downloaded_bytes
+                            journal.save(force=False)
+            finally:
+                if journal is not None:
+                    f.flush()
+                    journal.committed = committed + downloaded_bytes
+                    journal.save()
         # Return the number of bytes downloaded
         return progress.n
+
+
+def _download_segmented(url, path, session, file_size, segments, journal, timeout=None, limiters=(),
+                        position=None):
+    """Download a file in byte ranges over several parallel connections.
+
+    The target file is preallocated and every range is written at its offset. The progress of
+    the ranges is stored in the journal. A download is resumed from the ranges of the journal, or
+    from the end of a partial file of a plain download. position is the line of the progress bar.
+
+    Returns the number of bytes downloaded by this call.
+    """
+    ranges = journal.ranges
+    if ranges is None:
+        # Anything written by a plain download is a valid prefix of the file
+        start = min(getsize(path) if exists(path) else 0, file_size)
+        segments = max(1, min(segments, file_size - start))
+        bounds = [start + (file_size - start) * i // segments for i in range(segments + 1)]
+        # [first byte, end byte (exclusive), downloaded bytes]
+        ranges = journal.ranges = [[bounds[i], bounds[i + 1], 0] for i in range(segments)]
+
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    mode = 'r+b' if exists(path) else 'wb'
+    with open(path, mode) as f:
+        f.truncate(file_size)
+    journal.save()
+
+    def download_range(segment, progress):
+        first, end, done = segment
+        if first + done >= end:
+            return
+        headers = {'Range': 'bytes={}-{}'.format(first + done, end - 1)}
+        if journal.validator:
+            headers['If-Range'] = journal.validator
+        with closing(session.get(url, stream=True, auth=session.auth, headers=headers, timeout=timeout)) as r:
+            _check_scihub_response(r, test_json=False)
+            if r.status_code == 200 and 'If-Range' in headers:
+                raise _FileChangedError('The file has changed on the server', r)
+            if r.status_code != 206:
+                raise SentinelAPIError('Server does not support range requests', r)
+            with lock:
+                journal.set_validators(r)
+            with open(path, 'r+b') as f:
+                f.seek(first + done)
+                for chunk in r.iter_content(chunk_size=_chunk_size(limiters)):
+                    if stop.is_set():
+                        break
+                    if chunk:  # filter out keep-alive new chunks
+                        chunk = chunk[:end - first - segment[2]]
+                        for limiter in limiters:
+                            limiter.consume(len(chunk))
+                        f.write(chunk)
+                        # Only record data that has been handed to the operating system
+                        f.flush()
+                        with lock:
+                            segment[2] += len(chunk)
+                            progress.update(len(chunk))
+                            journal.save(force=False)
+
+    initial = sum(done for _, _, done in ranges) + ranges[0][0]
+    with closing(_progress_bar("Downloading", file_size, initial, position)) as progress:
+        try:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                futures = [executor.submit(download_range, segment, progress) for segment in ranges]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    # Let the other ranges finish their current chunk and stop
+                    stop.set()
+                    raise
+        finally:
+            with lock:
+                journal.committed = sum(done for _, _, done in ranges) + ranges[0][0]
+                journal.save()
+        downloaded_bytes = progress.n - initial
+
+    if any(first + done < end for first, end, done in ranges):
+        raise SentinelAPIError('Incomplete download of {}'.format(url))
+    return downloaded_bytes
+
+
+def _chunk_size(limiters):
+    """Download in 1 MB chunks, or in 64 KB chunks for an even throughput if it is limited"""
+    if any(limiter.rate is not None for limiter in limiters):
+        return 2 ** 16
+    return 2 ** 20
+
+
+def _load_complete_download(directory_path, product_id):
+    """Return the download journal of a product and, if its file is complete, its metadata"""
+    journal = _DownloadJournal.load(directory_path, product_id)
+    if journal is not None and journal.complete:
+        product_info = journal.product_info()
+        path = join(directory_path, product_info['title'] + '.zip')
+        if exists(path) and getsize(path) == product_info['size']:
+            return journal, product_info
+    return journal, None
+
+
+def _replace(src, dst):
+    """Rename a file, replacing dst atomically where the platform allows it"""
+    try:
+        replace = os.replace
+    except AttributeError:  # Python 2
+        if os.name == 'nt' and exists(dst):
+            remove(dst)
+        replace = os.rename
+    replace(src, dst)
+
+
+class _DownloadJournal(object):
+    """The state of a product download, stored as JSON in "<directory>/.sentinelsat/<id>.json".
+
+    Holds the product's metadata, whether the download is complete, the number of bytes written to
+    the ".part" file, the byte ranges of a segmented download and the ETag and Last-Modified
+    validators of the server.
+    """
+
+    def __init__(self, directory_path, product_info, complete=False, data=None):
+        self.path = _DownloadJournal.journal_path(directory_path, product_info['id'])
+        self.data = data or {
+            'product': dict((k, v.isoformat() + 'Z' if isinstance(v, datetime) else v)
+                            for k, v in product_info.items() if k not in ('path', 'downloaded_bytes')),
+            'dates': [k for k, v in product_info.items() if isinstance(v, datetime)],
+            'committed': 0,
+            'ranges': None,
+            'etag': None,
+            'last_modified': None,
+        }
+        self.data['complete'] = complete
+        self._saved = 0
+
+    @staticmethod
+    def journal_path(directory_path, product_id):
+        return join(directory_path, '.sentinelsat', product_id + '.json')
+
+    @classmethod
+    def load(cls, directory_path, product_id):
+        """Return the journal of a product or None if there is no valid one."""
+        path = cls.journal_path(directory_path, product_id)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            return cls(directory_path, data['product'], data['complete'], data)
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def product_info(self):
+        product_info = dict(self.data['product'])
+        for key in self.data['dates']:
+            product_info[key] = _parse_iso_date(product_info[key])
+        return product_info
+
+    def matches(self, product_info):
+        product = self.data['product']
+        return (product['size'] == product_info['size'] and
+                product.get('md5', '').lower() == product_info.get('md5', '').lower())
+
+    @property
+    def complete(self):
+        return self.data['complete']
+
+    @complete.setter
+    def complete(self, value):
+        self.data['complete'] = value
+        if value:
+            self.data['committed'] = self.data['product']['size']
+            self.data['ranges'] = None
+
+    @property
+    def committed(self):
+        return self.data['committed']
+
+    @committed.setter
+    def committed(self, value):
+        self.data['committed'] = value
+
+    @property
+    def ranges(self):
+        return self.data['ranges']
+
+    @ranges.setter
+    def ranges(self, value):
+        self.data['ranges'] = value
+
+    @property
+    def validator(self):
+        return self.data['etag'] or self.data['last_modified']
+
+    def set_validators(self, response):
+        self.data['etag'] = response.headers.get('ETag')
+        self.data['last_modified'] = response.headers.get('Last-Modified')
+
+    def save(self, force=True):
+        """Write the journal, at most once a second unless force is True."""
+        now = time.time()
+        if not force and now - self._saved < 1:
+            return
+        directory = dirname(self.path)
+        if not exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # created concurrently
+                if not exists(directory):
+                    raise
+        # Write a new file and rename it so that the journal is never half written
+        tmp_path = '{}.{}.tmp'.format(self.path, threading.current_thread().ident)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f)
+        _replace(tmp_path, self.path)
+        self._saved = now
+
+    def remove(self):
+        if exists(self.path):
+            remove(self.path)
@@ -41,6 +41,9 @@ setup(name='sentinelsat',
               'requests-mock',
               'vcrpy'
           ],
+          'async': [
+              'aiohttp'
+          ],
           'docs': [
               'sphinx',
               'numpydoc',
@@ -1,5 +1,10 @@
+import sys
+
 import pytest
 
+# AsyncSentinelAPI uses async/await syntax
+collect_ignore = ['test_aio.py'] if sys.version_info < (3, 5) else []
+
 
 def pytest_addoption(parser):
     parser.addoption("--vcr", choices=("use", "disable", "record_new", "reset"), default="use",
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web  # noqa: E402
+
+from sentinelsat import SentinelAPIError  # noqa: E402
+from sentinelsat.aio import AsyncSentinelAPI  # noqa: E402
+
+PRODUCT_DATA = b'0123456789' * 100
+GML_FOOTPRINT = ('<gml:Polygon xmlns:gml="http://www.opengis.net/gml"><gml:outerBoundaryIs><gml:LinearRing>'
+                 '<gml:coordinates>0,0 0,1 1,1 0,0</gml:coordinates>'
+                 '</gml:LinearRing></gml:outerBoundaryIs></gml:Polygon>')
+
+
+def _entry(i):
+    return {
+        'id': 'id%d' % i,
+        'title': 'S2A_product_%d' % i,
+        'link': [{'href': 'http://example.com/%d' % i}],
+        'str': [{'name': 'platformname', 'content': 'Sentinel-2'}],
+        'int': {'name': 'orbitnumber', 'content': str(i)},
+        'date': [{'name': 'beginposition', 'content': '2017-01-01T00:00:00.000Z'}],
+    }
+
+
+def _make_app(total, requests_log):
+    async def search(request):
+        data = await request.post()
+        requests_log.append((request.query['start'], data['q']))
+        start, rows = int(request.query['start']), int(request.query['rows'])
+        entries = [_entry(i) for i in range(start, min(start + rows, total))]
+        if data['q'] == 'invalid':
+            return web.Response(status=500, text='Invalid query', reason='Internal Server Error')
+        if data['q'] == 'malformed':
+            return web.json_response({'feed': {'opensearch:totalResults': 'many'}})
+        return web.json_response({'feed': {'opensearch:totalResults': str(total), 'entry': entries}})
+
+    async def odata(request):
+        product_id = request.match_info['id']
+        if product_id == 'missing':
+            return web.json_response({'error': {'code': None, 'message': {
+                'lang': 'en', 'value': 'Invalid key (missing) to access Products'}}}, status=500)
+        if product_id == 'malformed':
+            return web.json_response({'d': {'Id': product_id}})
+        return web.json_response({'d': {
+            'Id': product_id, 'Name': 'S2A_' + product_id, 'ContentLength': str(len(PRODUCT_DATA)),
+            'ContentGeometry': GML_FOOTPRINT, 'Attributes': {},
+            'Checksum': {'Algorithm': 'MD5', 'Value': hashlib.md5(PRODUCT_DATA).hexdigest()},
+            'CreationDate': '/Date(1483228800000)/', 'IngestionDate': '/Date(1483228800000)/',
+            'ContentDate': {'Start': '/Date(1483228800000)/', 'End': '/Date(1483228800000)/'},
+            '__metadata': {'media_src': str(request.url.with_path('/odata/v1/Products/%s/$value' % product_id)
+                                            .with_query(None))}}})
+
+    async def value(request):
+        start = 0
+        if 'Range' in request.headers:
+            start = int(request.headers['Range'].split('=')[1].rstrip('-'))
+        return web.Response(body=PRODUCT_DATA[start:], status=206 if start else 200)
+
+    app = web.Application()
+    app.router.add_post('/search', search)
+    app.router.add_get("/odata/v1/Products('{id}')", odata)
+    app.router.add_get('/odata/v1/Products/{id}/$value', value)
+    return app
+
+
+def _run_with_server(coro_func, total=0):
+    requests_log = []
+
+    async def main():
+        runner = web.AppRunner(_make_app(total, requests_log))
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            async with AsyncSentinelAPI('user', 'pw', 'http://127.0.0.1:%d' % port) as api:
+                return await coro_func(api)
+        finally:
+            await runner.cleanup()
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(main()), requests_log
+    finally:
+        loop.close()
+
+
+def test_async_query():
+    async def run(api):
+        api.page_size = 10
+        return await api.query(platformname='Sentinel-2', initial_date=None, end_date=None)
+
+    products, requests_log = _run_with_server(run, total=35)
+    assert list(products) == ['id%d' % i for i in range(35)]
+    assert products['id3']['orbitnumber'] == 3
+    assert sorted(int(start) for start, _ in requests_log) == [0, 10, 20, 30]
+    assert all(q == '(platformname:Sentinel-2)' for _, q in requests_log)
+
+
+def test_async_query_error():
+    async def run(api):
+        with pytest.raises(SentinelAPIError) as excinfo:
+            await api.query_raw('invalid')
+        return excinfo.value
+
+    error, _ = _run_with_server(run)
+    assert error.response.status_code == 500
+    assert 'Invalid query' in error.msg
+
+
+def test_async_query_malformed():
+    async def run(api):
+        with pytest.raises(SentinelAPIError) as excinfo:
+            await api.query_raw('malformed')
+        return excinfo.value
+
+    error, _ = _run_with_server(run)
+    assert error.response is None
+    assert str(error) == 'API response not valid. JSON decoding failed.'
+
+
+def test_async_download(tmpdir):
+    async def run(api):
+        odata = await api.get_product_odata('a')
+        assert odata['md5'] == hashlib.md5(PRODUCT_DATA).hexdigest()
+        # simulate a partial download
+        with open(str(tmpdir.join('S2A_b.zip')), 'wb') as f:
+            f.write(PRODUCT_DATA[:25])
+        return await api.download_all(['a', 'b', 'missing', 'a', 'malformed'], str(tmpdir), max_attempts=2,
+                                      checksum=True)
+
+    (downloaded, failed), _ = _run_with_server(run)
+    assert list(downloaded) == ['a', 'b']
+    assert failed == {'missing', 'malformed'}
+    assert downloaded['b']['downloaded_bytes'] == len(PRODUCT_DATA) - 25
+    for name in ('S2A_a.zip', 'S2A_b.zip'):
+        assert tmpdir.join(name).read_binary() == PRODUCT_DATA
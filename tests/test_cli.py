@@ -1,10 +1,11 @@
+from collections import OrderedDict
 from os import environ
 
 import pytest
 import requests_mock
 from click.testing import CliRunner
 
-from sentinelsat import InvalidChecksumError, SentinelAPI
+from sentinelsat import InvalidChecksumError, SentinelAPI, SentinelAPIError, read_geojson
 from sentinelsat.scripts.cli import cli
 from .shared import my_vcr
 
@@ -386,3 +387,185 @@ def test_download_invalid_id(tmpdir):
     )
     assert 'No product with' in result.output
     tmpdir.remove()
+
+
+@pytest.mark.mock_api
+def test_dry_run():
+    runner = CliRunner()
+    with requests_mock.mock() as rqst:
+        rqst.post('https://scihub.copernicus.eu/apihub/search?format=json&rows=100&start=0',
+                  json={'feed': {'opensearch:totalResults': '1234'}})
+        result = runner.invoke(
+            cli,
+            ['search'] +
+            _api_auth +
+            ['tests/map.geojson', '--dry-run'],
+            catch_exceptions=False
+        )
+        assert rqst.call_count == 1
+
+    assert result.exit_code == 0
+    assert '1234 scenes found in 13 pages' in result.output
+    assert 'Suggested sharding: 3 shards of up to 500 scenes' in result.output
+
+
+@pytest.mark.mock_api
+def test_connection_options():
+    runner = CliRunner()
+    with requests_mock.mock() as rqst:
+        rqst.post('https://scihub.copernicus.eu/apihub/search?format=json&rows=100&start=0',
+                  json={'feed': {'opensearch:totalResults': '0'}})
+        result = runner.invoke(
+            cli,
+            ['search'] +
+            _api_auth +
+            ['tests/map.geojson', '--dry-run', '--timeout', '12.5', '--retries', '1', '--connections', '2'],
+            catch_exceptions=False
+        )
+        assert rqst.last_request.timeout == 12.5
+
+    assert result.exit_code == 0
+
+
+@pytest.mark.mock_api
+def test_footprints_streamed(tmpdir):
+    runner = CliRunner()
+    entries = [{'id': 'id%d' % i, 'title': 'title%d' % i, 'summary': 'summary',
+                'str': [{'name': 'footprint', 'content': 'POLYGON((0 0,%d 0,%d 1,0 1,0 0))' % (i, i)},
+                        {'name': 'gmlfootprint', 'content': '<gml:Polygon/>'},
+                        {'name': 'size', 'content': '1 GB'}]}
+               for i in range(1, 3)]
+    with requests_mock.mock() as rqst:
+        rqst.post(requests_mock.ANY, json={'feed': {'opensearch:totalResults': '2', 'entry': entries}})
+        result = runner.invoke(
+            cli,
+            ['search'] +
+            _api_auth +
+            ['tests/map.geojson', '--path', str(tmpdir), '--footprints'],
+            catch_exceptions=False
+        )
+    assert result.exit_code == 0
+    footprints = read_geojson(str(tmpdir.join('search_footprints.geojson')))
+    assert [f['properties']['id'] for f in footprints['features']] == ['id1', 'id2']
+    assert footprints['features'][1]['geometry']['coordinates'] == [[[0, 0], [2, 0], [2, 1], [0, 1], [0, 0]]]
+
+
+@pytest.mark.mock_api
+def test_all_features():
+    runner = CliRunner()
+    with requests_mock.mock() as rqst:
+        rqst.post('https://scihub.copernicus.eu/apihub/search?format=json&rows=100&start=0',
+                  json={'feed': {'opensearch:totalResults': '0'}})
+        result = runner.invoke(
+            cli,
+            ['search'] +
+            _api_auth +
+            ['tests/map_multi.geojson', '--all-features'],
+            catch_exceptions=False
+        )
+        assert rqst.call_count == 1
+        assert rqst.last_request.text.count('Intersects') == 2
+
+    assert result.exit_code == 0
+    assert '0 scenes found' in result.output
+
+    result = runner.invoke(
+        cli,
+        ['search'] +
+        _api_auth +
+        ['tests/map_multi.geojson', '--all-features', '--dry-run']
+    )
+    assert result.exit_code != 0
+
+
+@pytest.mark.mock_api
+def test_download_workers(tmpdir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(SentinelAPI, 'download_all',
+                        lambda self, products, *args, **kwargs: calls.append(kwargs) or ({}, set()))
+    runner = CliRunner()
+    entries = [{'id': 'id%d' % i, 'title': 'title%d' % i, 'summary': 'summary',
+                'str': [{'name': 'footprint', 'content': 'POLYGON((0 0,1 0,1 1,0 1,0 0))'},
+                        {'name': 'size', 'content': '1 GB'}]}
+               for i in range(1, 3)]
+    with requests_mock.mock() as rqst:
+        rqst.post(requests_mock.ANY, json={'feed': {'opensearch:totalResults': '2', 'entry': entries}})
+        result = runner.invoke(
+            cli,
+            ['search'] +
+            _api_auth +
+            ['tests/map.geojson', '--path', str(tmpdir), '--download', '--workers', '4'],
+            catch_exceptions=False
+        )
+    assert result.exit_code == 0
+    assert calls[0]['workers'] == 4
+
+
+@pytest.mark.mock_api
+def test_verify(tmpdir, monkeypatch):
+    calls = []
+
+    def verify_all(self, products, directory_path, workers):
+        calls.append((products, directory_path, workers))
+        results = {'a': {'id': 'a', 'title': 'title_a', 'valid': True},
+                   'b': {'id': 'b', 'title': 'title_b', 'valid': False},
+                   'c': {'id': 'c', 'title': 'title_c', 'valid': None},
+                   'd': {'id': 'd', 'valid': False, 'error': SentinelAPIError('Invalid key (d)')}}
+        return OrderedDict((product_id, results[product_id]) for product_id in products)
+
+    monkeypatch.setattr(SentinelAPI, 'verify_all', verify_all)
+    runner = CliRunner()
+    result = runner.invoke(
+        cli,
+        ['verify'] +
+        _api_auth +
+        ['a', 'b', 'c', 'd', '--path', str(tmpdir), '--workers', '8'],
+        catch_exceptions=False
+    )
+    assert result.exit_code == 1
+    assert calls == [(('a', 'b', 'c', 'd'), str(tmpdir), 8)]
+    assert tmpdir.join('corrupt_scenes.txt').read().splitlines() == ['b : title_b', 'c : title_c', 'd : ']
+
+    tmpdir.join('corrupt_scenes.txt').remove()
+    result = runner.invoke(
+        cli,
+        ['verify'] +
+        _api_auth +
+        ['a', '--path', str(tmpdir)],
+        catch_exceptions=False
+    )
+    assert result.exit_code == 0
+    assert not tmpdir.join('corrupt_scenes.txt').check()
+
+
+@pytest.mark.mock_api
+def test_limit_rate(monkeypatch):
+    rates = []
+
+    class API(SentinelAPI):
+        def __init__(self, *args, **kwargs):
+            rates.append(kwargs['max_download_rate'])
+            SentinelAPI.__init__(self, *args, **kwargs)
+
+    monkeypatch.setattr('sentinelsat.scripts.cli.SentinelAPI', API)
+    runner = CliRunner()
+    with requests_mock.mock() as rqst:
+        rqst.post('https://scihub.copernicus.eu/apihub/search?format=json&rows=100&start=0',
+                  json={'feed': {'opensearch:totalResults': '0'}})
+        for rate in ('1.5M', '2048'):
+            result = runner.invoke(
+                cli,
+                ['search'] +
+                _api_auth +
+                ['tests/map.geojson', '--dry-run', '--limit-rate', rate],
+                catch_exceptions=False
+            )
+            assert result.exit_code == 0
+        result = runner.invoke(
+            cli,
+            ['search'] +
+            _api_auth +
+            ['tests/map.geojson', '--dry-run', '--limit-rate', 'fast'],
+        )
+        assert result.exit_code != 0
+    assert rates == [1.5 * 2 ** 20, 2048]
@@ -1,5 +1,11 @@
 import hashlib
+import json
+import math
+import re
 import textwrap
+import threading
+import zlib
+from collections import OrderedDict
 from datetime import date, datetime, timedelta
 from os import environ
 
@@ -8,9 +14,14 @@ import py.path
 import pytest
 import requests
 import requests_mock
-
-from sentinelsat import InvalidChecksumError, SentinelAPI, SentinelAPIError, geojson_to_wkt, read_geojson
-from sentinelsat.sentinel import _format_query_date, _md5_compare, _parse_odata_timestamp, _parse_opensearch_response
+from six.moves.urllib.parse import parse_qs, unquote, urlsplit
+from tqdm import tqdm
+
+from sentinelsat import InvalidChecksumError, LazyProduct, Product, ProductCatalogue, ProductTable, QueryCache, \
+    RateLimiter, SentinelAPI, SentinelAPIError, geojson_to_wkt, read_geojson, simplify_wkt, write_geojson
+from sentinelsat.sentinel import _format_query_date, _md5_compare, _parse_odata_timestamp, _parse_opensearch_response, \
+    _parse_query_date, _format_query_date_ms, _parse_iso_date, _md5_update, \
+    _parse_odata_response
 from .shared import my_vcr
 
 _api_auth = dict(user=environ.get('SENTINEL_USER'), password=environ.get('SENTINEL_PASSWORD'))
@@ -73,6 +84,50 @@ def test_convert_timestamp():
     assert _parse_odata_timestamp('/Date(1445588544652)/') == datetime(2015, 10, 23, 8, 22, 24, 652000)
 
 
+@pytest.mark.fast
+def test_parse_iso_date():
+    for date_str in ('2015-12-27T14:22:29Z', '2015-12-27T14:22:29.1Z', '2015-12-27T14:22:29.123Z',
+                     '2015-12-27T14:22:29.123456Z'):
+        fmt = '%Y-%m-%dT%H:%M:%S.%fZ' if '.' in date_str else '%Y-%m-%dT%H:%M:%SZ'
+        assert _parse_iso_date(date_str) == datetime.strptime(date_str, fmt)
+
+    for date_str in ('2015-13-27T14:22:29Z', '2015-12-27 14:22:29Z', '2015-12-27T14:22:29.Z',
+                     '2015-12-27T14:22:29.1234567Z', '2015-12-27', ''):
+        with pytest.raises(ValueError):
+            _parse_iso_date(date_str)
+
+
+@pytest.mark.fast
+def test_parse_opensearch_entry():
+    entries = [{
+        'id': 'id%d' % i,
+        'title': 'title%d' % i,
+        'link': [{'href': 'http://example.com/%d' % i}, {'rel': 'icon', 'href': 'http://example.com/icon'}],
+        'int': {'name': 'orbitnumber', 'content': '%d' % i},
+        'double': {'name': 'cloudcoverpercentage', 'content': '12.5'},
+        'date': [{'name': 'beginposition', 'content': '2017-01-01T00:00:00.000Z'}],
+        # Sentinel-3 products have an element without 'content'
+        'str': [{'name': 'platformname', 'content': 'Sentinel-3'}, {'name': 'productlevel', 'str': 'L2'}],
+        'arr': {'name': 'list', 'str': ['a', 'b']},
+    } for i in range(2)]
+    products = _parse_opensearch_response(entries)
+    assert list(products) == ['id0', 'id1']
+    assert products['id1'] == {
+        'title': 'title1',
+        'link': 'http://example.com/1',
+        'link_icon': 'http://example.com/icon',
+        'orbitnumber': 1,
+        'cloudcoverpercentage': 12.5,
+        'beginposition': datetime(2017, 1, 1),
+        'platformname': 'Sentinel-3',
+        'productlevel': 'L2',
+        'list': ['a', 'b'],
+    }
+    # repeated values are shared
+    assert products['id0']['beginposition'] is products['id1']['beginposition']
+    assert products['id0']['platformname'] is products['id1']['platformname']
+
+
 @pytest.mark.fast
 def test_md5_comparison():
     testfile_md5 = hashlib.md5()
@@ -456,6 +511,74 @@ def test_scihub_unresponsive():
             api.download_all(['8df46c9e-a20c-43db-a19a-4240c2ed3b8b'])
 
 
+@pytest.mark.mock_api
+def test_session_timeout_and_pool():
+    api = SentinelAPI("mock_user", "mock_password", timeout=(3.05, 27), max_parallel_pages=16, max_retries=5)
+    adapter = api.session.get_adapter(api.api_url)
+    assert adapter._pool_maxsize == 16
+    assert adapter.max_retries.total == 5
+    assert 503 in adapter.max_retries.status_forcelist
+    assert adapter.max_retries.respect_retry_after_header
+
+    with requests_mock.mock() as rqst:
+        rqst.post('https://scihub.copernicus.eu/apihub/search?format=json&rows=100&start=0',
+                  json={'feed': {'opensearch:totalResults': '0'}})
+        rqst.get("https://scihub.copernicus.eu/apihub/odata/v1/Products('8df46c9e')?$format=json",
+                 text='{"error":{"code":null,"message":{"lang":"en","value":"Invalid key"}}}', status_code=500)
+        api.query(**_small_query)
+        with pytest.raises(SentinelAPIError):
+            api.get_product_odata('8df46c9e')
+        assert [r.timeout for r in rqst.request_history] == [(3.05, 27)] * 2
+
+
+@pytest.mark.fast
+def test_retry_after():
+    import threading
+    from six.moves import BaseHTTPServer
+
+    requests_seen = []
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            if len(requests_seen) < 3:
+                self.send_response(503)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = b'{"d": {}}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:%d/' % server.server_address[1]
+        api = SentinelAPI("mock_user", "mock_password", url, timeout=5)
+        response = api.session.get(url + 'odata', timeout=api.timeout)
+        assert response.status_code == 200
+        assert len(requests_seen) == 3
+
+        del requests_seen[:]
+        api = SentinelAPI("mock_user", "mock_password", url, max_retries=1)
+        with pytest.raises(SentinelAPIError) as excinfo:
+            api.get_product_odata('8df46c9e')
+        assert excinfo.value.response.status_code == 503
+        assert len(requests_seen) == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
 @pytest.mark.mock_api
 def test_get_products_invalid_json():
     api = SentinelAPI("mock_user", "mock_password")
@@ -474,6 +597,561 @@ def test_get_products_invalid_json():
         assert excinfo.value.msg == "Invalid API response."
 
 
+def _mock_search_page(total_results, ids):
+    """Minimal OpenSearch JSON response with one entry per product id."""
+    entries = [{'id': id, 'title': 'title_' + id, 'str': {'name': 'uuid', 'content': id}} for id in ids]
+    return {'feed': {'opensearch:totalResults': str(total_results), 'entry': entries}}
+
+
+@pytest.mark.mock_api
+def test_load_query_concurrent_pages():
+    total = 250
+    ids = ['id_%03d' % i for i in range(total)]
+    search_url = 'https://scihub.copernicus.eu/apihub/search?format=json&rows=100&start={}'
+
+    for max_parallel_pages in (1, 4):
+        api = SentinelAPI("mock_user", "mock_password", max_parallel_pages=max_parallel_pages)
+        assert api.max_parallel_pages == max_parallel_pages
+        with requests_mock.mock() as rqst:
+            for start in range(0, total, api.page_size):
+                rqst.post(search_url.format(start),
+                          json=_mock_search_page(total, ids[start:start + api.page_size]))
+            products = api.query_raw('platformname:Sentinel-1')
+            assert rqst.call_count == 3
+        # pages are merged back in server order
+        assert list(products) == ids
+        assert products['id_123']['uuid'] == 'id_123'
+
+
+@pytest.mark.mock_api
+def test_iter_query_raw():
+    total = 250
+    ids = ['id_%03d' % i for i in range(total)]
+    search_url = 'https://scihub.copernicus.eu/apihub/search?format=json&rows=100&start={}'
+
+    api = SentinelAPI("mock_user", "mock_password", max_parallel_pages=1)
+    with requests_mock.mock() as rqst:
+        for start in range(0, total, api.page_size):
+            rqst.post(search_url.format(start),
+                      json=_mock_search_page(total, ids[start:start + api.page_size]))
+        products = api.iter_query_raw('platformname:Sentinel-1')
+        # nothing is requested before the generator is consumed
+        assert rqst.call_count == 0
+        product_id, props = next(products)
+        assert product_id == 'id_000'
+        assert props['uuid'] == 'id_000'
+        assert rqst.call_count == 1
+        assert [product_id] + [product_id for product_id, _ in products] == ids
+        assert rqst.call_count == 3
+
+        assert list(api.query_raw('platformname:Sentinel-1').items()) == \
+            list(api.iter_query_raw('platformname:Sentinel-1'))
+
+
+def _mock_search_hub(rqst, begin_positions):
+    """Serve OpenSearch requests from a fake catalogue of {<product id>: <beginposition>}.
+
+    Only the beginPosition range of the query is evaluated.
+    """
+    def search(request, context):
+        query = parse_qs(request.text)['q'][0]
+        begin, end = re.search(r'beginPosition:\[(\S+) TO (\S+)\]', query).groups()
+        begin, end = _parse_query_date(begin), _parse_query_date(end)
+        ids = [id for id, position in sorted(begin_positions.items()) if begin <= position <= end]
+        start, rows = int(request.qs['start'][0]), int(request.qs['rows'][0])
+        return _mock_search_page(len(ids), ids[start:start + rows])
+
+    rqst.post(requests_mock.ANY, json=search)
+
+
+@pytest.mark.mock_api
+def test_json_decoder(monkeypatch):
+    decoded = []
+
+    def decoder(content):
+        decoded.append(len(content))
+        return json.loads(content.decode('utf-8'))
+
+    def fail(*args, **kwargs):
+        raise AssertionError('Response.json() should not be called')
+
+    monkeypatch.setattr(requests.Response, 'json', fail)
+    api = SentinelAPI("mock_user", "mock_password", json_decoder=decoder)
+    with requests_mock.mock() as rqst:
+        rqst.post('https://scihub.copernicus.eu/apihub/search?format=json&rows=100&start=0',
+                  json=_mock_search_page(2, ['id0', 'id1']))
+        products = api.query(**_small_query)
+    assert list(products) == ['id0', 'id1']
+    assert len(decoded) == 1
+
+
+@pytest.mark.mock_api
+def test_query_sharded():
+    api = SentinelAPI("mock_user", "mock_password")
+    begin_positions = {'id_%03d' % i: datetime(2015, 1, 1) + timedelta(hours=i) for i in range(150)}
+    # three products acquired at the same time cannot be split further
+    begin_positions.update({'id_same_%d' % i: datetime(2015, 1, 3, 12, 30) for i in range(3)})
+
+    with requests_mock.mock() as rqst:
+        _mock_search_hub(rqst, begin_positions)
+        products = api.query(initial_date=datetime(2015, 1, 1), end_date=datetime(2015, 1, 8))
+        assert set(products) == set(begin_positions)
+
+        rqst.reset_mock()
+        sharded = api.query(initial_date=datetime(2015, 1, 1), end_date=datetime(2015, 1, 8), shard_size=2)
+        assert set(sharded) == set(begin_positions)
+        assert len(sharded) == len(begin_positions)
+        # every shard fits on a single, shallow page
+        for request in rqst.request_history:
+            assert request.qs['start'] == ['0']
+
+        with pytest.raises(ValueError):
+            api.query(initial_date=None, end_date=None, shard_size=2)
+
+
+@pytest.mark.mock_api
+def test_count_and_plan_query():
+    api = SentinelAPI("mock_user", "mock_password", max_parallel_pages=4)
+    begin_positions = {'id_%03d' % i: datetime(2015, 1, 1) + timedelta(minutes=i) for i in range(950)}
+
+    with requests_mock.mock() as rqst:
+        _mock_search_hub(rqst, begin_positions)
+        assert api.count(initial_date=datetime(2015, 1, 1), end_date=datetime(2015, 1, 1, 1)) == 61
+        assert rqst.last_request.qs['rows'] == ['0']
+
+        plan = api.plan_query(initial_date=datetime(2015, 1, 1), end_date=datetime(2015, 1, 2))
+        assert rqst.call_count == 2
+        assert rqst.last_request.qs['rows'] == ['100']
+        assert plan['query'] == '(beginPosition:[2015-01-01T00:00:00Z TO 2015-01-02T00:00:00Z])'
+        assert plan['total_results'] == 950
+        assert plan['pages'] == 10
+        assert plan['estimated_seconds'] >= 0
+        assert plan['suggested_shard_size'] == 500
+        assert plan['suggested_shards'] == 2
+
+        plan = api.plan_query(initial_date=datetime(2015, 1, 1), end_date=datetime(2015, 1, 1, 1))
+        assert plan['pages'] == 1
+        assert plan['suggested_shard_size'] is None
+        assert plan['suggested_shards'] == 0
+
+
+@pytest.mark.mock_api
+def test_query_cache(tmpdir):
+    cache = QueryCache(str(tmpdir.join('cache.sqlite')), ttl=60)
+    api = SentinelAPI("mock_user", "mock_password", cache=cache)
+    begin_positions = {'id_%03d' % i: datetime(2015, 1, 1) + timedelta(hours=i) for i in range(150)}
+    query = api.format_query(initial_date=datetime(2015, 1, 1), end_date=datetime(2015, 1, 8))
+
+    with requests_mock.mock() as rqst:
+        _mock_search_hub(rqst, begin_positions)
+        products = api.query_raw(query)
+        assert rqst.call_count == 2
+        assert len(products) == 150
+
+        # Served from the cache, also by a new API instance and with differing whitespace
+        api = SentinelAPI("mock_user", "mock_password", cache=cache)
+        assert api.query_raw(query.replace(' ', '  ')) == products
+        assert rqst.call_count == 2
+
+        # Forced refresh
+        assert api.query_raw(query, refresh=True) == products
+        assert rqst.call_count == 4
+
+        # A partially consumed query is not cached
+        cache.clear()
+        next(api.iter_query_raw(query))
+        assert cache.get(api.api_url, query) is None
+
+    # Expired results are not used
+    cache.set(api.api_url, query, [])
+    assert cache.get(api.api_url, query) == []
+    cache.ttl = -1
+    assert cache.get(api.api_url, query) is None
+
+
+@pytest.mark.fast
+def test_query_cache_eviction_and_keys(tmpdir):
+    api_url = 'https://scihub.copernicus.eu/apihub/'
+    entries = [{'id': str(i)} for i in range(10)]
+    entry_size = len(zlib.compress(json.dumps(entries).encode('utf-8')))
+    cache = QueryCache(str(tmpdir.join('cache.sqlite')), max_size=2.5 * entry_size)
+    cache.set(api_url, 'query 1', entries)
+    cache.set(api_url, 'query 2', entries)
+    assert cache.get(api_url, 'query 1') == entries
+    # query 2 is now the least recently used result
+    cache.set(api_url, 'query 3', entries)
+    assert cache.get(api_url, 'query 1') == entries
+    assert cache.get(api_url, 'query 2') is None
+    assert cache.get(api_url, 'query 3') == entries
+
+    # Relative dates are resolved into buckets of date_bucket seconds
+    assert cache.key(api_url, 'beginPosition:[NOW-1DAY TO NOW]') != cache.key(api_url, 'beginPosition:[NOW TO NOW]')
+    assert cache.key(api_url, 'a') != cache.key('https://scihub.copernicus.eu/dhus/', 'a')
+    normalized = cache.normalize_query('beginPosition:[NOW-1DAY TO NOW]')
+    assert 'NOW' not in normalized
+    assert normalized.endswith(':00:00Z]')
+
+
+@pytest.mark.mock_api
+def test_sync(tmpdir):
+    api = SentinelAPI("mock_user", "mock_password")
+    ingestion_dates = {}
+
+    def search(request, context):
+        query = parse_qs(request.text)['q'][0]
+        assert query.startswith('(footprint:"Intersects(POLYGON((0 0,1 1,0 1,0 0)))") AND (ingestiondate:[')
+        assert query.endswith(' TO NOW]) AND (producttype:SLC)')
+        begin = _parse_query_date(re.search(r'ingestiondate:\[(\S+) TO NOW\]', query).group(1))
+        entries = [{'id': id, 'date': {'name': 'ingestiondate', 'content': _format_query_date_ms(ingested)}}
+                   for id, ingested in sorted(ingestion_dates.items()) if ingested >= begin]
+        return {'feed': {'opensearch:totalResults': str(len(entries)), 'entry': entries}}
+
+    state = str(tmpdir.join('state.json'))
+    kwargs = dict(area='POLYGON((0 0,1 1,0 1,0 0))', state=state, producttype='SLC')
+    now = datetime.utcnow()
+    with requests_mock.mock() as rqst:
+        rqst.post(requests_mock.ANY, json=search)
+
+        ingestion_dates['a'] = now - timedelta(days=2)
+        ingestion_dates['b'] = now - timedelta(hours=2, milliseconds=500)
+        assert list(api.sync(**kwargs)) == ['b']
+        with open(state) as f:
+            assert json.load(f)['ids'] == ['b']
+        assert list(api.sync(**kwargs)) == []
+
+        # products ingested at the same instant as the last known one are not missed
+        ingestion_dates['c'] = ingestion_dates['b']
+        ingestion_dates['d'] = now - timedelta(hours=1)
+        assert list(api.sync(**kwargs)) == ['c', 'd']
+        assert list(api.sync(**kwargs)) == []
+
+        # the state also works as a dict
+        state_dict = {}
+        assert list(api.sync(area=kwargs['area'], state=state_dict, producttype='SLC',
+                             initial_date=now - timedelta(days=3))) == ['a', 'b', 'c', 'd']
+        assert state_dict['ids'] == ['d']
+
+        with pytest.raises(ValueError):
+            api.sync(state=state, producttype='GRD')
+
+
+@pytest.mark.fast
+def test_product_catalogue(tmpdir):
+    products = OrderedDict([
+        ('a', {'title': 'S1A_a', 'platformname': 'Sentinel-1', 'producttype': 'GRD', 'orbitnumber': 10,
+               'cloudcoverpercentage': 5.5, 'orbitdirection': 'ASCENDING', 'size': '1 GB',
+               'beginposition': datetime(2015, 1, 1), 'footprint': 'POLYGON((0 0,2 0,2 2,0 2,0 0))'}),
+        ('b', {'title': 'S2A_b', 'platformname': 'Sentinel-2', 'producttype': 'S2MSI1C', 'orbitnumber': 20,
+               'cloudcoverpercentage': 40.0, 'orbitdirection': 'DESCENDING', 'size': '5 GB',
+               'beginposition': datetime(2015, 1, 2), 'footprint': 'POLYGON((10 10,12 10,12 12,10 12,10 10))'}),
+        # the bounding box of this triangle overlaps with the search area below, but the triangle does not
+        ('c', {'title': 'S2A_c', 'platformname': 'Sentinel-2', 'producttype': 'S2MSI1C', 'orbitnumber': 30,
+               'cloudcoverpercentage': 10.0, 'orbitdirection': 'DESCENDING', 'size': '5 GB',
+               'beginposition': datetime(2015, 1, 3), 'footprint': 'POLYGON((3 0,6 0,6 3,3 0))'}),
+    ])
+    path = str(tmpdir.join('catalogue.sqlite'))
+    catalogue = ProductCatalogue(path)
+    assert catalogue.ingest(products) == 3
+    # updating existing products does not create duplicates
+    assert catalogue.ingest(products.items()) == 3
+    catalogue.close()
+
+    catalogue = ProductCatalogue(path)
+    assert len(catalogue) == 3
+    assert 'a' in catalogue
+    assert catalogue.get('a') == products['a']
+
+    def query(**kwargs):
+        return list(catalogue.query(initial_date=None, end_date=None, **kwargs))
+
+    assert query() == ['a', 'b', 'c']
+    assert list(catalogue.query(initial_date='20150102', end_date=datetime(2015, 1, 3))) == ['b', 'c']
+    assert query(platformname='sentinel-2') == ['b', 'c']
+    assert query(orbitdirection='Descending', orbitnumber=30) == ['c']
+    assert query(cloudcoverpercentage='[0 TO 10]') == ['a', 'c']
+    assert query(cloudcoverpercentage='[0 TO 10}') == ['a']
+    assert query(orbitnumber='[15 TO *]') == ['b', 'c']
+    assert query(title='S2A*') == ['b', 'c']
+    assert query(beginposition='[2015-01-02T00:00:00Z TO NOW]') == ['b', 'c']
+    assert query(unknownattribute='x') == []
+
+    pytest.importorskip('shapely')
+    assert query(area='POLYGON((1 1,3.9 1,3.9 2.5,1 2.5,1 1))') == ['a']
+    assert query(area='POLYGON((1 1,5 1,5 2.5,1 2.5,1 1))') == ['a', 'c']
+    assert query(area='POLYGON((11 11,20 11,20 20,11 20,11 11))', platformname='Sentinel-2') == ['b']
+
+
+def _mock_footprint_hub(rqst, footprints):
+    """Serve OpenSearch requests from a fake catalogue of {<product id>: <footprint WKT>}.
+
+    Only the footprint clauses of the query are evaluated.
+    """
+    shapely_wkt = pytest.importorskip('shapely.wkt')
+
+    def search(request, context):
+        query = parse_qs(request.text)['q'][0]
+        areas = [shapely_wkt.loads(wkt) for wkt in re.findall(r'Intersects\((.*?)\)"', query)]
+        entries = [{'id': id, 'str': {'name': 'footprint', 'content': footprint}}
+                   for id, footprint in sorted(footprints.items())
+                   if any(area.intersects(shapely_wkt.loads(footprint)) for area in areas)]
+        return {'feed': {'opensearch:totalResults': str(len(entries)), 'entry': entries}}
+
+    rqst.post(requests_mock.ANY, json=search)
+
+
+@pytest.mark.mock_api
+def test_query_many():
+    api = SentinelAPI("mock_user", "mock_password")
+    footprints = {
+        'a': 'POLYGON((0 0,3 0,3 3,0 3,0 0))',
+        'b': 'POLYGON((50 50,51 50,51 51,50 51,50 50))',
+        'c': 'POLYGON((100 0,101 0,101 1,100 1,100 0))',
+    }
+    areas = OrderedDict([
+        ('field_1', 'POLYGON((0 0,1 0,1 1,0 1,0 0))'),
+        ('field_2', 'POLYGON((2 2,2.5 2,2.5 2.5,2 2.5,2 2))'),
+        ('field_3', 'POLYGON((50.5 50.5,52 50.5,52 52,50.5 52,50.5 50.5))'),
+        ('field_4', 'POLYGON((-50 -50,-49 -50,-49 -49,-50 -49,-50 -50))'),
+    ])
+
+    with requests_mock.mock() as rqst:
+        _mock_footprint_hub(rqst, footprints)
+        products, product_areas = api.query_many(areas, producttype='GRD')
+        assert rqst.call_count == 1
+        assert parse_qs(rqst.last_request.text)['q'][0].startswith(
+            '(beginPosition:[NOW-1DAY TO NOW]) AND (producttype:GRD) AND (footprint:"Intersects(')
+        assert sorted(products) == ['a', 'b']
+        assert sorted(product_areas['a']) == ['field_1', 'field_2']
+        assert product_areas['b'] == ['field_3']
+
+        # Shorter queries: nearby fields are still grouped together
+        rqst.reset_mock()
+        products, product_areas = api.query_many(areas, max_query_length=180)
+        assert rqst.call_count == 3
+        queries = [parse_qs(request.text)['q'][0] for request in rqst.request_history]
+        assert any(areas['field_1'] in query and areas['field_2'] in query for query in queries)
+        assert sorted(products) == ['a', 'b']
+        assert sorted(product_areas['a']) == ['field_1', 'field_2']
+
+        products, product_areas = api.query_many(list(areas.values()), initial_date=None, end_date=None)
+        assert sorted(product_areas['a']) == [0, 1]
+
+        assert api.query_many([]) == ({}, {})
+
+
+@pytest.mark.fast
+def test_simplify_wkt():
+    shapely_wkt = pytest.importorskip('shapely.wkt')
+    # A circle with a wavy outline
+    ring = ['%f %f' % (10 + math.cos(i * math.pi / 100) * (1 + 0.05 * math.sin(i)),
+                       50 + math.sin(i * math.pi / 100) * (1 + 0.05 * math.sin(i))) for i in range(200)]
+    wkt = 'POLYGON((%s))' % ','.join(ring + ring[:1])
+    original = shapely_wkt.loads(wkt)
+
+    for tolerance, max_vertices, expected_max_vertices in [(0.01, None, 200), (0.01, 20, 20), (0, 6, 5)]:
+        simplified = shapely_wkt.loads(simplify_wkt(wkt, tolerance, max_vertices))
+        assert simplified.contains(original)
+        assert len(simplified.exterior.coords) <= expected_max_vertices
+        assert simplified.hausdorff_distance(original) < 2
+
+
+@pytest.mark.mock_api
+def test_query_simplified_area():
+    api = SentinelAPI("mock_user", "mock_password")
+    footprints = {
+        'a': 'POLYGON((0 0,1 0,1 1,0 1,0 0))',
+        # inside the bounding box, but outside of the L-shaped area
+        'b': 'POLYGON((8 8,9 8,9 9,8 9,8 8))',
+        'c': 'POLYGON((20 20,21 20,21 21,20 21,20 20))',
+    }
+    area = 'POLYGON((0 0,10 0,10 2,2 2,2 10,0 10,0 0))'
+
+    with requests_mock.mock() as rqst:
+        _mock_footprint_hub(rqst, footprints)
+        assert list(api.query(area)) == ['a']
+        simplified = simplify_wkt(area, max_vertices=5)
+        # the server returns both a and b for the simplified area, but b is filtered out
+        assert sorted(api.query(simplified)) == ['a', 'b']
+        assert list(api.query(area, area_max_vertices=5)) == ['a']
+        assert simplified in parse_qs(rqst.last_request.text)['q'][0]
+
+
+@pytest.mark.mock_api
+def test_compact_products(tmpdir):
+    import pickle
+
+    entries = [{
+        'id': 'id%d' % i,
+        'title': 'S1A_%d' % i,
+        'link': {'href': 'http://example.com/%d' % i},
+        'int': {'name': 'orbitnumber', 'content': str(i)},
+        'date': {'name': 'beginposition', 'content': '2017-01-01T00:00:00.000Z'},
+        'str': [{'name': 'platformname', 'content': 'Sentinel-1'},
+                {'name': 'instrumentname', 'content': 'Synthetic Aperture Radar (C-band)'},
+                {'name': 'size', 'content': '1.5 GB'},
+                {'name': 'footprint', 'content': 'POLYGON ((0 0,1 0,1 1,0 1,0 0))'},
+                {'name': 'gmlfootprint', 'content': '<gml:Polygon/>'},
+                {'name': 'rareattribute', 'content': 'rare'}],
+    } for i in range(2)]
+    api = SentinelAPI("mock_user", "mock_password", compact=True)
+    with requests_mock.mock() as rqst:
+        rqst.post(requests_mock.ANY, json={'feed': {'opensearch:totalResults': '2', 'entry': entries}})
+        products = api.query(**_small_query)
+        api.compact = False
+        expected = api.query(**_small_query)
+
+    assert all(isinstance(props, Product) for props in products.values())
+    assert products == expected
+    product = products['id1']
+    assert product['orbitnumber'] == 1
+    assert product['rareattribute'] == 'rare'
+    assert 'uuid' not in product and product.get('uuid') is None
+    assert len(product) == len(expected['id1'])
+    assert sorted(product) == sorted(expected['id1'])
+    assert product['instrumentname'] is products['id0']['instrumentname']
+    assert pickle.loads(pickle.dumps(product)) == product
+    with pytest.raises(AttributeError):
+        product.newattribute = 1
+
+    product = product.copy()
+    product['uuid'] = 'id1'
+    del product['rareattribute']
+    del product['title']
+    with pytest.raises(KeyError):
+        product['title']
+    with pytest.raises(KeyError):
+        del product['rareattribute']
+    assert set(product) == set(expected['id1']) - {'title', 'rareattribute'} | {'uuid'}
+
+    assert SentinelAPI.get_products_size(products) == 3.0
+    geojson_products = SentinelAPI.to_geojson(products)
+    assert geojson_products == SentinelAPI.to_geojson(expected)
+    assert geojson.dumps(geojson_products)
+
+    catalogue = ProductCatalogue()
+    catalogue.ingest(products)
+    assert catalogue.get('id0') == expected['id0']
+
+
+@pytest.mark.mock_api
+def test_lazy_products(monkeypatch):
+    import pickle
+    import sentinelsat.sentinel
+
+    entries = [{
+        'id': 'id%d' % i,
+        'title': 'S1A_%d' % i,
+        'link': [{'href': 'http://example.com/%d' % i}, {'rel': 'icon', 'href': 'http://example.com/icon'}],
+        'int': {'name': 'orbitnumber', 'content': str(i)},
+        'double': {'name': 'cloudcoverpercentage', 'content': '12.5'},
+        'date': [{'name': 'beginposition', 'content': '2017-01-01T00:00:00.000Z'},
+                 {'name': 'endposition', 'content': '2017-01-01T00:00:10.000Z'}],
+        'str': [{'name': 'footprint', 'content': 'POLYGON ((0 0,2 0,2 1,0 1,0 0))'},
+                {'name': 'gmlfootprint', 'content': '<gml:Polygon/>'},
+                {'name': 'productlevel', 'str': 'L2'}],
+    } for i in range(2)]
+    api = SentinelAPI("mock_user", "mock_password", lazy=True)
+    with requests_mock.mock() as rqst:
+        rqst.post(requests_mock.ANY, json={'feed': {'opensearch:totalResults': '2', 'entry': entries}})
+        products = api.query(**_small_query)
+        api.lazy = False
+        expected = api.query(**_small_query)
+
+    parsed_dates = []
+    parse_iso_date = sentinelsat.sentinel._parse_iso_date
+    monkeypatch.setattr(sentinelsat.sentinel, '_parse_iso_date', lambda d: parsed_dates.append(d) or parse_iso_date(d))
+    import sentinelsat.products
+    monkeypatch.setattr(sentinelsat.products, '_lazy_converters', {})
+
+    product = products['id1']
+    assert isinstance(product, LazyProduct)
+    assert product['title'] == 'S1A_1'
+    assert product['orbitnumber'] == 1
+    assert parsed_dates == []
+    assert product['beginposition'] == datetime(2017, 1, 1)
+    assert product['beginposition'] is product['beginposition']
+    assert parsed_dates == ['2017-01-01T00:00:00.000Z']
+    assert 'endposition' in product and 'uuid' not in product
+    assert sorted(product) == sorted(expected['id1'])
+    assert products == expected
+    assert len(parsed_dates) == 4
+
+    product['uuid'] = 'id1'
+    del product['productlevel']
+    assert product['uuid'] == 'id1' and 'productlevel' not in product
+    restored = pickle.loads(pickle.dumps(product))
+    assert isinstance(restored, LazyProduct) and restored == product
+    assert SentinelAPI.to_geojson(products) == SentinelAPI.to_geojson(
+        OrderedDict((k, dict(v)) for k, v in products.items()))
+
+    pytest.importorskip('shapely')
+    assert product.geometry.area == 2
+    assert product.geometry is product.geometry
+
+
+@pytest.mark.mock_api
+@pytest.mark.pandas
+def test_query_table():
+    np = pytest.importorskip('numpy')
+    pytest.importorskip('pandas')
+    entries = [{
+        'id': 'id0',
+        'title': 'S1A_0',
+        'link': {'href': 'http://example.com/0'},
+        'int': [{'name': 'orbitnumber', 'content': '10'}, {'name': 'slicenumber', 'content': '3'}],
+        'double': {'name': 'cloudcoverpercentage', 'content': '12.5'},
+        'date': {'name': 'beginposition', 'content': '2017-01-01T10:00:00.123Z'},
+        'str': [{'name': 'size', 'content': '1.5 GB'}, {'name': 'platformname', 'content': 'Sentinel-1'}],
+    }, {
+        'id': 'id1',
+        'title': 'S1A_1',
+        'link': {'href': 'http://example.com/1'},
+        'int': {'name': 'orbitnumber', 'content': '11'},
+        'date': {'name': 'beginposition', 'content': '2017-01-02T10:00:00Z'},
+        'str': [{'name': 'size', 'content': '750 MB'}, {'name': 'productlevel', 'str': 'L2'}],
+    }]
+    api = SentinelAPI("mock_user", "mock_password")
+    with requests_mock.mock() as rqst:
+        rqst.post(requests_mock.ANY, json={'feed': {'opensearch:totalResults': '2', 'entry': entries}})
+        table = api.query_table(**_small_query)
+
+    assert len(table) == 2
+    assert list(table) == ['id0', 'id1']
+    assert table['orbitnumber'].dtype == np.int64
+    assert list(table['orbitnumber']) == [10, 11]
+    assert table['slicenumber'].dtype == np.float64 and np.isnan(table['slicenumber'][1])
+    assert table['beginposition'].dtype == np.dtype('datetime64[ms]')
+    assert table['beginposition'][0] == np.datetime64('2017-01-01T10:00:00.123')
+    assert list(table['size']) == [int(1.5 * 2 ** 30), 750 * 2 ** 20]
+    assert list(table['platformname']) == ['Sentinel-1', None]
+    assert list(table['productlevel']) == [None, 'L2']
+    assert SentinelAPI.get_products_size(table) == 2.23
+
+    df = SentinelAPI.to_dataframe(table)
+    assert list(df.index) == ['id0', 'id1']
+    assert df['title']['id1'] == 'S1A_1'
+    assert df['beginposition']['id1'].to_pydatetime() == datetime(2017, 1, 2, 10)
+
+    pa = pytest.importorskip('pyarrow')
+    arrow_table = table.to_arrow()
+    assert arrow_table.column_names[:2] == ['id', 'title']
+    assert arrow_table.column('orbitnumber').type == pa.int64()
+    assert arrow_table.column('beginposition').type == pa.timestamp('ms')
+    assert arrow_table.column('slicenumber').null_count == 1
+    assert arrow_table.column('platformname').to_pylist() == ['Sentinel-1', None]
+
+
+@pytest.mark.fast
+def test_parse_query_date():
+    assert _parse_query_date(date(2015, 1, 1)) == datetime(2015, 1, 1)
+    assert _parse_query_date('20150101') == datetime(2015, 1, 1)
+    assert _parse_query_date('2015-01-01T10:00:00.5Z') == datetime(2015, 1, 1, 10, 0, 0, 500000)
+    now = _parse_query_date('NOW')
+    assert abs(datetime.utcnow() - now) < timedelta(minutes=1)
+    assert abs(now - timedelta(days=2) - _parse_query_date('NOW-2DAYS')) < timedelta(minutes=1)
+    assert _parse_query_date('NOW-12MONTHS').year == now.year - 1
+
+
 @my_vcr.use_cassette
 @pytest.mark.scihub
 def test_footprints_s1():
@@ -564,6 +1242,55 @@ def test_to_geopandas(products):
     assert abs(gdf.unary_union.area - 132.16) < 0.01
 
 
+@pytest.mark.mock_api
+def test_write_geojson(tmpdir):
+    from six import StringIO
+
+    entries = [{'id': 'id%d' % i, 'title': 'title%d' % i,
+                'date': {'name': 'beginposition', 'content': '2017-01-0%dT10:00:00.5Z' % i},
+                'str': [{'name': 'footprint', 'content': 'POLYGON((0 0,%d 0,%d 1,0 1,0 0))' % (i, i)},
+                        {'name': 'gmlfootprint', 'content': '<gml:Polygon/>'}]}
+               for i in range(1, 4)]
+    products = _parse_opensearch_response(entries)
+    expected = SentinelAPI.to_geojson(products)
+
+    for compact in (False, True):
+        out = StringIO()
+        assert write_geojson(products if not compact else
+                             OrderedDict((k, Product(v)) for k, v in products.items()), out) == 3
+        assert geojson.loads(out.getvalue()) == expected
+
+    api = SentinelAPI("mock_user", "mock_password")
+    path = str(tmpdir.join('footprints.geojson'))
+    with requests_mock.mock() as rqst:
+        rqst.post(requests_mock.ANY, json={'feed': {'opensearch:totalResults': '3', 'entry': entries}})
+        with open(path, 'w') as f:
+            write_geojson(api.iter_query(**_small_query), f)
+    assert read_geojson(path) == expected
+    assert read_geojson(path)['features'][0]['properties']['beginposition'] == '2017-01-01T10:00:00.500000Z'
+
+    out = StringIO()
+    assert write_geojson({}, out) == 0
+    assert geojson.loads(out.getvalue()) == geojson.FeatureCollection([])
+
+
+@pytest.mark.pandas
+@pytest.mark.geopandas
+@pytest.mark.fast
+def test_to_geopandas_footprints():
+    pytest.importorskip('geopandas')
+    entries = [{'id': 'id%d' % i, 'title': 'title%d' % i,
+                'str': [{'name': 'footprint', 'content': 'POLYGON((0 0,%d 0,%d 1,0 1,0 0))' % (i, i)},
+                        {'name': 'gmlfootprint', 'content': '<gml:Polygon/>'}]}
+               for i in range(1, 4)]
+    for products in (_parse_opensearch_response(entries), ProductTable.from_entries(entries)):
+        gdf = SentinelAPI.to_geodataframe(products)
+        assert list(gdf.index) == ['id1', 'id2', 'id3']
+        assert list(gdf.geometry.area) == [1, 2, 3]
+        assert 'footprint' not in gdf and 'gmlfootprint' not in gdf
+        assert list(gdf['title']) == ['title1', 'title2', 'title3']
+
+
 @my_vcr.use_cassette
 @pytest.mark.scihub
 def test_download(tmpdir):
@@ -646,7 +1373,7 @@ def test_download_all(tmpdir):
         "1f62a176-c980-41dc-b3a1-c735d660c910"
     ]
 
-    # Download normally
+    # Download normally, the metadata is looked up in a single batch
     product_infos, failed_downloads = api.download_all(ids, str(tmpdir))
     assert len(failed_downloads) == 0
     assert len(product_infos) == len(ids)
@@ -664,12 +1391,470 @@ def test_download_all(tmpdir):
         url = "https://scihub.copernicus.eu/apihub/odata/v1/Products('%s')?$format=json" % id
         json = api.session.get(url).json()
         json["d"]["Checksum"]["Value"] = "00000000000000000000000000000000"
-        rqst.get(url, json=json)
+        # The metadata of the missing product is prefetched in a batch of one
+        batch = rqst.get(re.compile(r".*/odata/v1/Products\?.*\$filter="), json={"d": {"results": [json["d"]]}})
         product_infos, failed_downloads = api.download_all(
             ids, str(tmpdir), max_attempts=1, checksum=True)
         assert len(failed_downloads) == 1
         assert len(product_infos) + len(failed_downloads) == len(ids)
         assert id in failed_downloads
+        assert batch.call_count == 1
+
+
+_GML_FOOTPRINT = ('<gml:Polygon xmlns:gml="http://www.opengis.net/gml"><gml:outerBoundaryIs><gml:LinearRing>'
+                  '<gml:coordinates>0,0 0,1 1,1 0,0</gml:coordinates>'
+                  '</gml:LinearRing></gml:outerBoundaryIs></gml:Polygon>')
+
+
+def _odata_product(product_id, data, checksum=None, api_url='https://scihub.copernicus.eu/apihub/'):
+    return {
+        'Id': product_id, 'Name': 'S2A_' + product_id, 'ContentLength': str(len(data)),
+        'Checksum': {'Algorithm': 'MD5', 'Value': checksum or hashlib.md5(data).hexdigest()},
+        'ContentDate': {'Start': '/Date(1483228800000)/', 'End': '/Date(1483228800000)/'},
+        'ContentGeometry': _GML_FOOTPRINT, 'Attributes': {},
+        '__metadata': {'media_src': api_url + "odata/v1/Products('%s')/$value" % product_id}}
+
+
+def _mock_product(rqst, product_id, data, checksum=None, on_value=None,
+                  api_url='https://scihub.copernicus.eu/apihub/'):
+    """Register the OData metadata and $value URLs of a product with a requests_mock mocker.
+
+    Range requests are answered with the requested part of data.
+    """
+    value_url = api_url + "odata/v1/Products('%s')/$value" % product_id
+    rqst.get(api_url + "odata/v1/Products('%s')?$format=json" % product_id,
+             json={'d': _odata_product(product_id, data, checksum, api_url)})
+
+    def value(request, context):
+        if on_value is not None:
+            on_value(request)
+        match = re.match(r'bytes=(\d+)-(\d*)', request.headers.get('Range', ''))
+        if match is None:
+            return data
+        end = int(match.group(2)) + 1 if match.group(2) else len(data)
+        context.status_code = 206
+        context.headers['Content-Range'] = 'bytes %s-%d/%d' % (match.group(1), end - 1, len(data))
+        return data[int(match.group(1)):end]
+
+    rqst.get(value_url, content=value)
+    return value_url
+
+
+def _mock_odata_batches(rqst, products, api_url='https://scihub.copernicus.eu/apihub/'):
+    """Answer batched OData metadata requests for a dictionary of product ids and data."""
+    def batch(request, context):
+        ids = re.findall(r"Id eq '([^']*)'", unquote(request.url))
+        return {'d': {'results': [_odata_product(product_id, products[product_id], api_url=api_url)
+                                  for product_id in ids if product_id in products]}}
+
+    rqst.get(api_url + 'odata/v1/Products', json=batch)
+
+
+@pytest.mark.mock_api
+def test_download_all_prefetch(tmpdir):
+    api = SentinelAPI('mock_user', 'mock_password')
+    data = b'0123456789' * 1000
+    ids = ['id0', 'id1', 'id2']
+
+    with requests_mock.mock() as rqst:
+        for product_id in ids:
+            # The single product lookup reports a wrong checksum and must not be used
+            _mock_product(rqst, product_id, data, checksum='0' * 32)
+        # id2 is missing from the batch and looked up on its own
+        _mock_odata_batches(rqst, dict.fromkeys(ids[:2], data))
+        product_infos, failed_downloads = api.download_all(ids, str(tmpdir), max_attempts=1, checksum=True)
+
+        assert list(product_infos) == ['id0', 'id1']
+        assert failed_downloads == {'id2'}
+        urls = [unquote(r.url) for r in rqst.request_history]
+        assert urls[0] == ("https://scihub.copernicus.eu/apihub/odata/v1/Products?$format=json&$top=3"
+                           "&$filter=Id eq 'id0' or Id eq 'id1' or Id eq 'id2'")
+        lookups = [url for url in urls if url.endswith('?$format=json')]
+        assert lookups == ["https://scihub.copernicus.eu/apihub/odata/v1/Products('id2')?$format=json"]
+
+
+@pytest.mark.mock_api
+def test_get_products_odata():
+    api = SentinelAPI('mock_user', 'mock_password', max_parallel_pages=2)
+    data = b'0123456789' * 10
+    ids = ['id%d' % i for i in range(7)]
+    with requests_mock.mock() as rqst:
+        _mock_odata_batches(rqst, dict.fromkeys(ids[:5], data))
+        products, failed = api.get_products_odata(ids, batch_size=3)
+        assert list(products) == ids[:5]
+        assert products['id3'] == _parse_odata_response(_odata_product('id3', data))
+        assert products['id3']['md5'] == hashlib.md5(data).hexdigest()
+        assert sorted(failed) == ['id5', 'id6']
+        assert 'Invalid key' in failed['id6'].msg
+        assert str(failed['id6']) == 'Invalid key (id6) to access Products'
+        assert rqst.call_count == 3
+        filters = sorted(parse_qs(urlsplit(r.url).query)['$filter'][0] for r in rqst.request_history)
+        assert filters[0] == "Id eq 'id0' or Id eq 'id1' or Id eq 'id2'"
+
+        # Failed batches are reported without affecting the others
+        rqst.get(re.compile(r".*id6.*"), status_code=500, text='error')
+        products, failed = api.get_products_odata(ids, full=True, batch_size=3)
+        assert list(products) == ids[:5]
+        assert sorted(failed) == ['id5', 'id6']
+        assert isinstance(failed['id6'], SentinelAPIError)
+        assert failed['id6'].response.status_code == 500
+        assert str(failed['id6']).startswith('HTTP status 500')
+        assert all('$expand=Attributes' in r.url for r in rqst.request_history[-3:])
+
+
+@pytest.mark.mock_api
+def test_download_all_workers(tmpdir, monkeypatch):
+    api = SentinelAPI('mock_user', 'mock_password')
+    ids = ['id%d' % i for i in range(6)]
+    data = b'0123456789' * 1000
+    threads = set()
+    positions = []
+
+    def on_value(request):
+        threads.add(threading.current_thread().ident)
+
+    def progress_bar(*args, **kwargs):
+        positions.append(kwargs.get('position'))
+        return tqdm(*args, **kwargs)
+
+    monkeypatch.setattr('sentinelsat.sentinel.tqdm', progress_bar)
+
+    with requests_mock.mock() as rqst:
+        for product_id in ids:
+            checksum = '0' * 32 if product_id == 'id2' else None
+            _mock_product(rqst, product_id, data, checksum=checksum, on_value=on_value)
+        product_infos, failed_downloads = api.download_all(
+            ids + ids[:3], str(tmpdir), max_attempts=2, checksum=True, workers=3)
+
+    assert failed_downloads == {'id2'}
+    assert list(product_infos) == [i for i in ids if i != 'id2']
+    for product_info in product_infos.values():
+        assert tmpdir.join(product_info['title'] + '.zip').read_binary() == data
+    assert not tmpdir.join('S2A_id2.zip').check()
+    # requests_mock serializes the requests, but they are sent from the worker threads
+    assert 1 < len(threads) <= 3
+    # Every worker draws its progress bars on its own line
+    assert positions and set(positions) <= {0, 1, 2}
+    # Repeated ids are downloaded once, id2 is retried once
+    downloads = [r.url for r in rqst.request_history if unquote(r.url).endswith('/$value')]
+    assert len(downloads) == len(ids) + 1
+
+
+@pytest.mark.mock_api
+def test_download_hashes_while_downloading(tmpdir, monkeypatch):
+    def read_again(*args):
+        raise AssertionError('the file should not be read again')
+
+    monkeypatch.setattr('sentinelsat.sentinel._md5_compare', read_again)
+    api = SentinelAPI('mock_user', 'mock_password')
+    data = b'0123456789' * 1000
+    path = tmpdir.join('S2A_id0.zip')
+    with requests_mock.mock() as rqst:
+        _mock_product(rqst, 'id0', data)
+        product_info = api.download('id0', str(tmpdir), checksum=True)
+        assert path.read_binary() == data
+        assert product_info['downloaded_bytes'] == len(data)
+
+        # The partial file is hashed before the rest is appended
+        path.write_binary(data[:2500])
+        product_info = api.download('id0', str(tmpdir), checksum=True)
+        assert path.read_binary() == data
+        assert product_info['downloaded_bytes'] == len(data) - 2500
+
+        path.write_binary(b'x' * 2500)
+        with pytest.raises(InvalidChecksumError):
+            api.download('id0', str(tmpdir), checksum=True)
+        assert not path.check()
+
+
+@pytest.mark.mock_api
+def test_download_journal(tmpdir):
+    api = SentinelAPI('mock_user', 'mock_password')
+    data = b'0123456789' * 1000
+    ids = ['id0', 'id1']
+    headers = []
+
+    def on_value(request):
+        headers.append(request.headers)
+
+    with requests_mock.mock() as rqst:
+        for product_id in ids:
+            value_url = _mock_product(rqst, product_id, data, on_value=on_value)
+        _mock_odata_batches(rqst, dict.fromkeys(ids, data))
+        product_infos, failed = api.download_all(ids, str(tmpdir))
+        assert not failed
+        assert tmpdir.join('S2A_id0.zip').read_binary() == data
+        assert not tmpdir.join('S2A_id0.zip.part').check()
+        journal = json.loads(tmpdir.join('.sentinelsat', 'id0.json').read())
+        assert journal['complete'] is True
+        assert journal['committed'] == len(data)
+        assert journal['product']['md5'] == hashlib.md5(data).hexdigest()
+
+        # Complete products are skipped without looking up their metadata
+        rqst.reset_mock()
+        tmpdir.join('S2A_id1.zip').remove()
+        product_infos_restarted = api.download_all(ids, str(tmpdir))[0]
+        assert product_infos_restarted['id0'] == dict(product_infos['id0'], downloaded_bytes=0)
+        assert product_infos_restarted['id1'] == product_infos['id1']
+        assert [unquote(r.url) for r in rqst.request_history] == [
+            "https://scihub.copernicus.eu/apihub/odata/v1/Products?$format=json&$top=1&$filter=Id eq 'id1'",
+            value_url.replace('id0', 'id1')]
+
+        # An interrupted download is continued from the .part file if the server's file is unchanged
+        tmpdir.join('S2A_id1.zip').remove()
+        tmpdir.join('S2A_id1.zip.part').write_binary(data[:4000])
+        journal = json.loads(tmpdir.join('.sentinelsat', 'id1.json').read())
+        journal.update(complete=False, committed=4000, etag='"abc"')
+        tmpdir.join('.sentinelsat', 'id1.json').write(json.dumps(journal))
+        del headers[:]
+        product_info = api.download('id1', str(tmpdir), checksum=True)
+        assert product_info['downloaded_bytes'] == len(data) - 4000
+        assert tmpdir.join('S2A_id1.zip').read_binary() == data
+        assert headers[0]['Range'] == 'bytes=4000-'
+        assert headers[0]['If-Range'] == '"abc"'
+
+        # An unfinished download of a product with another checksum is discarded
+        tmpdir.join('S2A_id1.zip').remove()
+        tmpdir.join('S2A_id1.zip.part').write_binary(b'x' * 4000)
+        journal.update(product=dict(journal['product'], md5='0' * 32))
+        tmpdir.join('.sentinelsat', 'id1.json').write(json.dumps(journal))
+        product_info = api.download('id1', str(tmpdir), checksum=True)
+        assert product_info['downloaded_bytes'] == len(data)
+        assert tmpdir.join('S2A_id1.zip').read_binary() == data
+
+
+@pytest.mark.fast
+def test_rate_limiter(monkeypatch):
+    clock = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+
+    monkeypatch.setattr('sentinelsat.ratelimit._clock', lambda: clock[0])
+    monkeypatch.setattr('sentinelsat.ratelimit.time.sleep', sleep)
+
+    limiter = RateLimiter(1000)
+    # A full bucket allows a burst of one second
+    limiter.consume(1000)
+    assert sleeps == []
+    limiter.consume(500)
+    assert sleeps == [0.5]
+    # The bucket is refilled at the given rate
+    clock[0] += 0.25
+    limiter.consume(250)
+    assert sleeps == [0.5]
+    limiter.consume(2000)
+    assert sleeps == [0.5, 2.0]
+
+    # The rate can be changed or removed at runtime
+    limiter.rate = 4000
+    limiter.consume(2000)
+    assert sleeps == [0.5, 2.0, 0.5]
+    limiter.rate = None
+    limiter.consume(10 ** 9)
+    assert len(sleeps) == 3
+
+
+@pytest.mark.mock_api
+def test_download_rate_limit(tmpdir):
+    consumed = []
+
+    class CountingLimiter(RateLimiter):
+        def consume(self, n):
+            consumed.append((self.rate, n))
+            RateLimiter.consume(self, n)
+
+    limiter = CountingLimiter(10 ** 9)
+    api = SentinelAPI('mock_user', 'mock_password', max_download_rate=limiter)
+    assert api.rate_limiter is limiter
+    assert SentinelAPI('mock_user', 'mock_password', max_download_rate=500).rate_limiter.rate == 500
+    data = b'0123456789' * 10000
+    with requests_mock.mock() as rqst:
+        for product_id in ('id0', 'id1'):
+            _mock_product(rqst, product_id, data)
+        api.download('id0', str(tmpdir), max_rate=10 ** 9)
+        assert sum(n for _, n in consumed) == len(data)
+        # Chunks are small enough for an even throughput
+        assert max(n for _, n in consumed) <= 2 ** 16
+
+        del consumed[:]
+        api.download_all(['id1'], str(tmpdir), segments=2)
+        assert sum(n for _, n in consumed) == len(data)
+    assert tmpdir.join('S2A_id1.zip').read_binary() == data
+
+
+@pytest.mark.mock_api
+def test_download_segmented(tmpdir):
+    api = SentinelAPI('mock_user', 'mock_password')
+    data = bytes(bytearray(range(256))) * 40
+    ranges = []
+    failing = []
+
+    def on_value(request):
+        ranges.append(request.headers['Range'])
+        if request.headers['Range'] in failing:
+            raise requests.exceptions.ConnectionError('connection lost')
+
+    with requests_mock.mock() as rqst:
+        _mock_product(rqst, 'id0', data, on_value=on_value)
+        path = tmpdir.join('S2A_id0.zip')
+        part_path = tmpdir.join('S2A_id0.zip.part')
+        journal_path = tmpdir.join('.sentinelsat', 'id0.json')
+
+        product_info = api.download('id0', str(tmpdir), checksum=True, segments=4)
+        assert path.read_binary() == data
+        assert product_info['downloaded_bytes'] == len(data)
+        assert sorted(ranges) == ['bytes=0-2559', 'bytes=2560-5119', 'bytes=5120-7679', 'bytes=7680-10239']
+        assert not part_path.check()
+
+        # An interrupted download only fetches the missing ranges when resumed
+        path.remove()
+        del ranges[:]
+        failing.append('bytes=5120-7679')
+        with pytest.raises(requests.exceptions.ConnectionError):
+            api.download('id0', str(tmpdir), segments=4)
+        assert not path.check()
+        assert part_path.size() == len(data)
+        assert json.loads(journal_path.read())['ranges'][2] == [5120, 7680, 0]
+
+        del ranges[:]
+        del failing[:]
+        product_info = api.download('id0', str(tmpdir), checksum=True)
+        assert path.read_binary() == data
+        assert 'bytes=5120-7679' in ranges
+        assert 'bytes=0-2559' not in ranges
+        assert product_info['downloaded_bytes'] < len(data)
+        assert not part_path.check()
+
+        # A partial file of a plain download is continued
+        path.write_binary(data[:1000])
+        del ranges[:]
+        product_info = api.download('id0', str(tmpdir), checksum=True, segments=2)
+        assert path.read_binary() == data
+        assert sorted(ranges) == ['bytes=1000-5619', 'bytes=5620-10239']
+        assert product_info['downloaded_bytes'] == len(data) - 1000
+
+
+@pytest.mark.mock_api
+def test_download_segmented_incomplete(tmpdir):
+    api = SentinelAPI('mock_user', 'mock_password')
+    data = b'0123456789' * 100
+    with requests_mock.mock() as rqst:
+        value_url = _mock_product(rqst, 'id0', data)
+        # The server ends every range early
+        rqst.get(value_url, status_code=206, content=data[:10])
+        with pytest.raises(SentinelAPIError) as excinfo:
+            api.download('id0', str(tmpdir), segments=2)
+    assert str(excinfo.value) == 'Incomplete download of ' + value_url
+    assert excinfo.value.response is None
+
+
+@pytest.mark.mock_api
+def test_download_segmented_without_range_support(tmpdir):
+    api = SentinelAPI('mock_user', 'mock_password')
+    data = b'0123456789' * 100
+    with requests_mock.mock() as rqst:
+        value_url = _mock_product(rqst, 'id0', data)
+        rqst.get(value_url, content=data)
+        with pytest.raises(SentinelAPIError) as excinfo:
+            api.download('id0', str(tmpdir), segments=2)
+    assert 'range requests' in excinfo.value.msg
+
+
+@pytest.mark.mock_api
+def test_download_segmented_changed_file(tmpdir):
+    api = SentinelAPI('mock_user', 'mock_password')
+    data = b'0123456789' * 1000
+    etag = ['"old"']
+    failing = []
+    headers = []
+
+    def value(request, context):
+        headers.append(request.headers)
+        context.headers['ETag'] = etag[0]
+        if request.headers.get('If-Range', etag[0]) != etag[0]:
+            # The server sends the whole file if it has changed
+            return data
+        if request.headers['Range'] in failing:
+            raise requests.exceptions.ConnectionError('connection lost')
+        first, last = re.match(r'bytes=(\d+)-(\d+)', request.headers['Range']).groups()
+        context.status_code = 206
+        return data[int(first):int(last) + 1]
+
+    with requests_mock.mock() as rqst:
+        value_url = _mock_product(rqst, 'id0', data)
+        rqst.get(value_url, content=value)
+        failing.append('bytes=5000-9999')
+        with pytest.raises(requests.exceptions.ConnectionError):
+            api.download('id0', str(tmpdir), segments=2)
+        assert json.loads(tmpdir.join('.sentinelsat', 'id0.json').read())['etag'] == '"old"'
+
+        # The stale journal and partial file are discarded and the download starts over
+        etag[0] = '"new"'
+        del failing[:]
+        del headers[:]
+        product_info = api.download('id0', str(tmpdir), checksum=True, segments=2)
+        assert tmpdir.join('S2A_id0.zip').read_binary() == data
+        assert not tmpdir.join('S2A_id0.zip.part').check()
+        assert product_info['downloaded_bytes'] == len(data)
+        assert headers[0]['If-Range'] == '"old"'
+        assert sorted(h['Range'] for h in headers[1:]) == ['bytes=0-4999', 'bytes=5000-9999']
+        assert all(h.get('If-Range') != '"old"' for h in headers[1:])
+        journal = json.loads(tmpdir.join('.sentinelsat', 'id0.json').read())
+        assert journal['complete'] is True
+        assert journal['etag'] == '"new"'
+
+
+@pytest.mark.mock_api
+def test_verify_all(tmpdir):
+    api = SentinelAPI('mock_user', 'mock_password')
+    data = b'0123456789' * 1000
+    ids = ['valid', 'corrupt', 'incomplete', 'missing']
+    tmpdir.join('S2A_valid.zip').write_binary(data)
+    tmpdir.join('S2A_corrupt.zip').write_binary(b'x' * len(data))
+    tmpdir.join('S2A_incomplete.zip').write_binary(data[:100])
+    expected = OrderedDict([('valid', True), ('corrupt', False), ('incomplete', False), ('missing', None)])
+
+    with requests_mock.mock() as rqst:
+        for product_id in ids:
+            _mock_product(rqst, product_id, data)
+        results = api.verify_all(ids, str(tmpdir), workers=2)
+        assert OrderedDict((k, v['valid']) for k, v in results.items()) == expected
+        assert results['valid']['path'] == str(tmpdir.join('S2A_valid.zip'))
+        assert results['corrupt']['title'] == 'S2A_corrupt'
+        assert rqst.call_count == len(ids)
+
+        # The metadata of downloaded products is not requested again
+        product_infos = OrderedDict((product_id, api.get_product_odata(product_id)) for product_id in ids)
+        rqst.reset_mock()
+        results = api.verify_all(product_infos, str(tmpdir))
+        assert OrderedDict((k, v['valid']) for k, v in results.items()) == expected
+        assert rqst.call_count == 0
+        assert 'valid' not in product_infos['valid']
+
+        # An unknown product does not affect the others
+        rqst.get("https://scihub.copernicus.eu/apihub/odata/v1/Products('unknown')?$format=json",
+                 status_code=500, json={'error': {'code': None, 'message': {
+                     'lang': 'en', 'value': 'Invalid key (unknown) to access Products'}}})
+        results = api.verify_all(['valid', 'unknown', 'corrupt'], str(tmpdir), workers=2)
+        assert [v['valid'] for v in results.values()] == [True, False, False]
+        assert isinstance(results['unknown']['error'], SentinelAPIError)
+        assert 'Invalid key' in str(results['unknown']['error'])
+
+
+@pytest.mark.fast
+def test_md5_update_large_blocks(tmpdir):
+    data = bytes(bytearray(range(256))) * 1000
+    path = tmpdir.join('file')
+    path.write_binary(data)
+    blocks = []
+    md5 = _md5_update(hashlib.md5(), str(path), block_size=100000, callback=blocks.append)
+    assert md5.hexdigest() == hashlib.md5(data).hexdigest()
+    assert blocks == [100000, 100000, 56000]
+    path.write_binary(b'')
+    assert _md5_update(hashlib.md5(), str(path)).hexdigest() == hashlib.md5().hexdigest()
 
 
 @my_vcr.use_cassette